@@ -0,0 +1,206 @@
+import argparse
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Local stand-in for the ElectricityMaps carbon intensity history endpoint.
+# Answers /v3/carbon-intensity/history?zone=..&date=.. and past-range?zone=..&start=..&end=.. (cut
+# off at the current time) from recorded responses when present and otherwise with deterministic
+# synthetic history (same zone and date, same values), optionally adding latency and failing a
+# share of requests. With --upstream it works as a recording proxy: missing responses are fetched
+# from the real API once and stored for later offline replays.
+#
+#   python api_stub.py --port 8080 --latency 50 --failure-rate 0.02
+#   ELECTRICITYMAPS_API_URL=http://127.0.0.1:8080 streamlit run main.py
+
+HISTORY_PATH = "/v3/carbon-intensity/history"
+PAST_RANGE_PATH = "/v3/carbon-intensity/past-range"
+RECORDINGS_DIR = "recordings"
+ZONE_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9_-]{0,31}")  # e.g. DE, US-CAL-CISO
+DAY_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+# File of the recorded response of a zone and day (YYYY-MM-DD). Both come from the query string,
+# so anything but a plain zone code and date is refused before it can reach the file system.
+def recording_path(recordings, zone, day):
+    if not ZONE_PATTERN.fullmatch(zone) or not DAY_PATTERN.fullmatch(day):
+        raise ValueError(f"Invalid zone {zone!r} or date {day!r}.")
+    return os.path.join(recordings, zone, f"{day}.json")
+
+
+# Deterministic synthetic history for a zone and day: a zone-specific base level with a midday dip
+def synthetic_history(zone, day):
+    rng = random.Random(f"{zone}:{day}")
+    base = random.Random(zone).uniform(80, 550)
+    history = []
+    for hour in range(24):
+        solar = math.exp(-((hour - 13) / 3.5) ** 2)
+        intensity = max(5.0, base * (1 - 0.35 * solar) * rng.uniform(0.9, 1.1))
+        history.append({
+            "zone": zone,
+            "carbonIntensity": round(intensity),
+            "datetime": f"{day}T{hour:02d}:00:00.000Z",
+            "isEstimated": False,
+        })
+    return {"zone": zone, "history": history}
+
+
+class StubConfig:
+    def __init__(self, recordings=RECORDINGS_DIR, latency_ms=0.0, jitter_ms=0.0, failure_rate=0.0,
+                 failure_status=503, upstream=None, token=None, seed=None):
+        self.recordings = recordings
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self.token = token
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def recording_path(self, zone, day):
+        return recording_path(self.recordings, zone, day)
+
+
+def _load_or_record(config, zone, day):
+    path = config.recording_path(zone, day)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read()
+    if config.upstream is None:
+        return json.dumps(synthetic_history(zone, day)).encode()
+    url = f"{config.upstream}{HISTORY_PATH}?zone={zone}&date={day}"
+    request = urllib.request.Request(url, headers={"auth-token": config.token or ""})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        body = response.read()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(body)
+    return body
+
+
+# Hours from start up to end (exclusive) or now, cut from the day histories
+def _past_range(config, zone, start, end):
+    start = datetime.strptime(start[:19], "%Y-%m-%dT%H:%M:%S")
+    end = min(datetime.strptime(end[:19], "%Y-%m-%dT%H:%M:%S"), datetime.utcnow())
+    entries = []
+    day = start.date()
+    while day <= end.date():
+        for entry in json.loads(_load_or_record(config, zone, day.isoformat()))["history"]:
+            hour = datetime.strptime(entry["datetime"][:19], "%Y-%m-%dT%H:%M:%S")
+            if start <= hour < end:
+                entries.append(entry)
+        day += timedelta(days=1)
+    return json.dumps({"zone": zone, "data": entries}).encode()
+
+
+def make_handler(config):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+        disable_nagle_algorithm = True  # headers and body are separate writes
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body, headers=()):
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            with config.lock:
+                config.requests += 1
+                delay = config.latency_ms + config.random.uniform(-config.jitter_ms, config.jitter_ms)
+                fail = config.random.random() < config.failure_rate
+            if delay > 0:
+                time.sleep(delay / 1000)
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if url.path not in (HISTORY_PATH, PAST_RANGE_PATH) or "zone" not in query:
+                self._send(404, b'{"error": "not found"}')
+                return
+            if fail:
+                retry = [("Retry-After", "0")] if config.failure_status == 429 else []
+                self._send(config.failure_status, b'{"error": "injected failure"}', retry)
+                return
+            zone = query["zone"][0]
+            try:
+                if url.path == PAST_RANGE_PATH:
+                    body = _past_range(config, zone, query["start"][0], query["end"][0])
+                else:
+                    day = query.get("date", [datetime.utcnow().strftime("%Y-%m-%d")])[0][:10]
+                    body = _load_or_record(config, zone, day)
+            except (KeyError, ValueError):
+                self._send(400, b'{"error": "bad request"}')
+                return
+            except (urllib.error.URLError, OSError) as error:
+                self._send(502, json.dumps({"error": str(error)}).encode())
+                return
+            self._send(200, body)
+
+    return StubHandler
+
+
+# Serve in a background thread, returning (server, base_url); call server.shutdown() to stop
+def start_in_thread(config=None, host="127.0.0.1", port=0):
+    server = ThreadingHTTPServer((host, port), make_handler(config or StubConfig()))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}"
+
+
+# Write synthetic recordings for every zone and day of a range, e.g. to seed a fixture set
+def generate_recordings(zones, start, end, recordings=RECORDINGS_DIR):
+    day = start
+    while day <= end:
+        for zone in zones:
+            path = recording_path(recordings, zone, day.isoformat())
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(synthetic_history(zone, day.isoformat()), f)
+        day += timedelta(days=1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the ElectricityMaps history API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--recordings", default=RECORDINGS_DIR, help="directory of recorded responses")
+    parser.add_argument("--latency", type=float, default=0.0, help="added latency per request in ms")
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform latency jitter in ms")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of requests that fail")
+    parser.add_argument("--failure-status", type=int, default=503, help="HTTP status of injected failures")
+    parser.add_argument("--upstream", help="real API base URL to record missing responses from")
+    parser.add_argument("--token", default=os.environ.get("ELECTRICITYMAPS_API_TOKEN"), help="upstream token")
+    parser.add_argument("--seed", type=int, help="seed for latency jitter and failures")
+    args = parser.parse_args(argv)
+
+    config = StubConfig(args.recordings, args.latency, args.jitter, args.failure_rate, args.failure_status,
+                        args.upstream, args.token, args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(config))
+    server.daemon_threads = True
+    print(f"Serving {HISTORY_PATH} on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import functools
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from carbon_api import fetch_many
+from charts import render_capacity_sweep, render_zone_chart, render_zone_facets
+from history_store import HistoryStore
+from incremental import FleetGraph
+from ingestion import load_charging
+from instrumentation import metrics
+from intensity_cache import TODAY_TTL_SECONDS, IntensityCache
+from live import POLL_SECONDS, LiveDay
+from ranking import percentile_ranks, rank_slice
+from resampling import resample
+from scoring import HOURLY_CAPACITY, capacity_sweep, score_sites
+from uncertainty import monte_carlo
+
+# Rerun-aware memoization for the Streamlit app.
+# Every widget interaction re-executes the whole script, so each stage (fetching, CSV parsing,
+# table building, chart rendering) is memoized on the content of its inputs with a bounded LRU
+# cache, and scoring is kept incremental per session. Cosmetic interactions then hit every cache,
+# and only the stages whose inputs changed rerun. Lookups, hits and compute time of every stage
+# are recorded in the metrics.
+
+MAX_ENTRIES = 64
+PAGE_SIZE = 50  # rows of the ranking table sent to the browser at a time
+
+_lookup_state = threading.local()
+
+
+# st.cache_data with the stage's lookups, hits and compute time recorded under name
+def _memoized(name, **cache_options):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def compute(*args, **kwargs):
+            _lookup_state.missed = True
+            with metrics.stage(name):
+                return fn(*args, **kwargs)
+
+        cached = st.cache_data(max_entries=MAX_ENTRIES, show_spinner=False, **cache_options)(compute)
+
+        @functools.wraps(fn)
+        def lookup(*args, **kwargs):
+            _lookup_state.missed = False
+            try:
+                return cached(*args, **kwargs)
+            finally:
+                metrics.record_lookup(name, hit=not _lookup_state.missed)
+
+        lookup.clear = cached.clear
+        return lookup
+    return decorator
+
+# Persistent cache of fetched intensities, keyed by zone and date
+intensity_cache = IntensityCache()
+# Memory-mapped history of complete days, read and extended by the date range analysis
+history_store = HistoryStore()
+
+
+class _IncompleteFetch(Exception):
+    def __init__(self, intensities):
+        super().__init__("incomplete carbon intensity fetch")
+        self.intensities = intensities
+
+
+# Exceptions are not memoized, so a fetch with failed zones is retried on the next rerun
+@_memoized("fetch_zones", ttl=TODAY_TTL_SECONDS)
+def _cached_zone_intensities(zones, date):
+    results = fetch_many([(zone, date) for zone in zones], cache=intensity_cache)
+    intensities = {zone: results[(zone, date)] for zone in zones}
+    if any(len(values) == 0 for values in intensities.values()):
+        raise _IncompleteFetch(intensities)
+    return intensities
+
+
+# Function to fetch the carbon intensities of all selected zones on the selected day
+def fetch_zone_intensities(zones, date):
+    try:
+        return _cached_zone_intensities(tuple(zones), date)
+    except _IncompleteFetch as incomplete:
+        for zone, values in incomplete.intensities.items():
+            if len(values) == 0:
+                st.error(f"Failed to fetch carbon intensities for {zone} on {date}.")
+        return incomplete.intensities
+
+
+# Rendered intensity charts, keyed on zone, date and the plotted values
+@_memoized("chart")
+def zone_chart_png(zone, date, values):
+    return render_zone_chart(zone, values)
+
+
+@_memoized("chart")
+def zone_facets_png(date, intensities):
+    return render_zone_facets(intensities)
+
+
+# Table of carbon intensities per zone with units
+@_memoized("intensity_table")
+def build_intensity_table(intensities):
+    df_intensities = pd.DataFrame(intensities).T
+    df_intensities.index.name = 'Zone'
+    df_intensities.columns.name = 'Hour'
+    return df_intensities.rename(columns={h: f'{h}: gCO2/kWh' for h in df_intensities.columns})
+
+
+# Parse an uploaded charging CSV or Parquet file of slot_minutes slots, keyed on the file's bytes
+@_memoized("charging_upload")
+def load_charging_upload(data, name, slot_minutes=60):
+    return load_charging(data, name=name, slot_minutes=slot_minutes)
+
+
+# Score the fleet through a per-session FleetGraph, so a rerun after one company's charging changed
+# rescores that company only; the graph is rebuilt when the fleet, zones or parameters change
+def score_fleet(charging, intensities, hourly_capacity=HOURLY_CAPACITY, zone_ids=None, slot_hours=1.0):
+    charging, intensities = np.atleast_2d(charging), np.atleast_2d(intensities)
+    graph = st.session_state.get("fleet_graph")
+    if (graph is None or graph.shape != (charging.shape, intensities.shape)
+            or (graph.hourly_capacity, graph.slot_hours) != (hourly_capacity, slot_hours)
+            or (zone_ids is not None and not np.array_equal(graph.zone_ids, zone_ids))):
+        graph = FleetGraph(charging, intensities, zone_ids, hourly_capacity, slot_hours)
+        st.session_state["fleet_graph"] = graph
+    else:
+        graph.update(charging, intensities)
+    return graph.results()
+
+
+# Intensity matrix of the zones of a multi-site fleet, resampled to the charging resolution.
+# Stops the page when a zone's intensities could not be fetched.
+def site_intensities(zones, date, slot_minutes=60):
+    intensities = fetch_zone_intensities(zones, date)
+    partial = [zone for zone in zones if 0 < len(intensities[zone]) < 24]
+    if partial:
+        st.error(f"Carbon intensities for {', '.join(partial)} on {date} are not complete yet.")
+    if any(len(intensities[zone]) != 24 for zone in zones):
+        st.stop()
+    return resample(np.array([intensities[zone] for zone in zones]), 60, slot_minutes)
+
+
+# Score a multi-site fleet: every site in its own zone, summed per company
+@_memoized("score_sites")
+def score_fleet_sites(site_charging, intensities, site_companies, site_zones, n_companies,
+                      hourly_capacity=HOURLY_CAPACITY, slot_hours=1.0):
+    return score_sites(site_charging, intensities, site_companies, site_zones, hourly_capacity,
+                       n_companies=n_companies, slot_hours=slot_hours)
+
+
+# Monte Carlo score and rank intervals, keyed on the fleet, the perturbations and the seed
+@_memoized("monte_carlo")
+def score_uncertainty(charging, intensities, zone_ids, draws, noise, seed, slot_hours=1.0, site_companies=None,
+                      n_companies=None):
+    return monte_carlo(charging, intensities, zone_ids, draws, charging_noise=noise, intensity_noise=noise,
+                       slot_hours=slot_hours, seed=seed, site_companies=site_companies, n_companies=n_companies)
+
+
+# Scores over a grid of hourly capacities, keyed on the fleet and the grid
+@_memoized("capacity_sweep")
+def sweep_capacities(charging, intensities, zone_ids, capacities, slot_hours=1.0, site_companies=None,
+                     n_companies=None):
+    return capacity_sweep(charging, intensities, capacities, zone_ids, slot_hours=slot_hours,
+                          site_companies=site_companies, n_companies=n_companies)
+
+
+# Rendered sensitivity curves of the chosen companies, with the fleet's spread for larger fleets
+@_memoized("chart")
+def capacity_sweep_png(capacities, scores, companies, chosen):
+    band = tuple(np.percentile(scores, [10, 50, 90], axis=1)) if len(companies) > len(chosen) else None
+    return render_capacity_sweep(capacities, {companies[i]: scores[:, i] for i in chosen}, band)
+
+
+# Companies shown in the ranking table and their ranks, in rank order. A fleet larger than one
+# page can be narrowed to its top or bottom k or a percentile band and is paginated, so only the
+# visible rows are selected, formatted and sent to the browser; key tells apart the widgets of
+# several ranking tables on one page.
+def ranking_rows(scores, key="ranking"):
+    n_companies = len(scores)
+    start, stop = 0, n_companies
+    if n_companies > PAGE_SIZE:
+        view = st.radio("Show", ["All companies", "Top k", "Bottom k", "Percentile band"], horizontal=True,
+                        key=f"{key}_view")
+        if view == "Top k":
+            stop = st.number_input("k", 1, n_companies, 10, key=f"{key}_k")
+        elif view == "Bottom k":
+            start = n_companies - st.number_input("k", 1, n_companies, 10, key=f"{key}_k")
+        elif view == "Percentile band":
+            band = st.slider("Percentile band", 0, 100, (0, 10), key=f"{key}_band")
+            start, stop = percentile_ranks(n_companies, *band)
+        if stop - start > PAGE_SIZE:
+            pages = -(-(stop - start) // PAGE_SIZE)
+            page = st.number_input(f"Page (of {pages})", 1, pages, 1, key=f"{key}_page")
+            start = start + (page - 1) * PAGE_SIZE
+            stop = min(start + PAGE_SIZE, stop)
+    with metrics.stage("rank_select"):
+        rows = rank_slice(scores, start, stop)
+        return rows, np.arange(start + 1, start + 1 + len(rows))
+
+
+# Live ranking of today's partial day (UTC) in a fragment that reruns on its own every poll_seconds,
+# so an open page is refreshed without rerunning the whole script. The session's LiveDay keeps the
+# hours received so far and each run fetches only the newer ones; charging is hourly.
+def show_live_ranking(companies, charging, zones, zone_ids, site_companies=None, poll_seconds=POLL_SECONDS):
+    @st.fragment(run_every=timedelta(seconds=poll_seconds))
+    def live_panel():
+        today = datetime.utcnow().date()
+        live = st.session_state.get("live_day")
+        if (live is None or live.day != today or live.zones != list(zones)
+                or live.charging.shape != charging.shape or not np.array_equal(live.charging, charging)
+                or not np.array_equal(live.zone_ids, zone_ids)):
+            live = LiveDay(zones, today, charging, zone_ids, site_companies=site_companies,
+                           n_companies=len(companies))
+            st.session_state["live_day"] = live
+        if live.due(poll_seconds):
+            live.poll()
+        if live.failed_zones:
+            st.warning(f"Could not poll {', '.join(live.failed_zones)}; retrying at the next poll.")
+        results = live.results()
+        if results is None:
+            st.info("Waiting for the first hour of today's carbon intensities.")
+            return
+        st.caption(f"{live.hours} of 24 hours of {today} (UTC), last polled at {live.polled_at:%H:%M:%S} UTC")
+        rows, ranks = ranking_rows(results.score, key="live")
+        st.dataframe(pd.DataFrame({
+            "Company": [companies[i] for i in rows],
+            "Score": results.score[rows],
+            "Emissions so far (gCO2)": results.emissions[rows],
+        }, index=pd.Index(ranks, name="Rank")))
+
+    live_panel()
+
+
+# Random example charging values, drawn once per session so reruns do not change them
+def default_charging_values():
+    if "default_charging_values" not in st.session_state:
+        st.session_state["default_charging_values"] = {
+            'Hour': list(range(24)),
+            'Company 1 (kW)': np.random.randint(0, 13, 24),  # valores entre 0 e 12
+            'Company 2 (kW)': np.random.randint(0, 13, 24),  # valores entre 0 e 12
+            'Company 3 (kW)': np.random.randint(0, 13, 24)   # valores entre 0 e 12
+        }
+    return st.session_state["default_charging_values"]
+
+
+# Optional sidebar panel with the per-stage timings and cache hit ratios of this server process
+def show_metrics_panel():
+    if not st.sidebar.checkbox("Show pipeline timings"):
+        return
+    snapshot = metrics.snapshot()
+    st.sidebar.subheader("Stage timings")
+    st.sidebar.dataframe(pd.DataFrame.from_dict(snapshot["stages"], orient="index"))
+    st.sidebar.subheader("Cache hit ratios")
+    st.sidebar.dataframe(pd.DataFrame.from_dict(snapshot["caches"], orient="index"))
+    st.sidebar.download_button("Export JSON", metrics.to_json(), file_name="metrics.json",
+                               mime="application/json")
+    st.sidebar.download_button("Export Prometheus text", metrics.to_prometheus(), file_name="metrics.prom",
+                               mime="text/plain")
@@ -0,0 +1,230 @@
+import argparse
+import csv
+import multiprocessing
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from history_store import DTYPE as STORE_DTYPE, STORE_DIR, HistoryStore
+from ingestion import load_charging
+from instrumentation import metrics
+from pipeline import parse_date
+from resampling import HOURS_PER_DAY, resample
+from scoring import HOURLY_CAPACITY, default_zone_ids, encode_sites, score_companies, score_from_totals, sum_sites
+
+# Parallel multi-day backtesting.
+# A backtest scores a fleet on every day of a range from a (zones x hours) intensity matrix, e.g.
+# years read from the HistoryStore. The work is cut into (day block, company block) shards run on
+# a process pool. Charging, intensities and the result arrays live in shared memory, so only the
+# names of the buffers and the shard bounds are sent to the workers, and each worker writes its
+# shard straight into the (days x companies) time series. Shards score all their days in one
+# batched pass by flattening the days into rows, as the Monte Carlo runner does with its draws.
+# Intensities keep the store's float32 and the command line reads them from the store straight
+# into their shared buffer, so years of history are held once.
+#
+#   python backtest.py fleet.csv --zones DE --start 2023-01-01 --end 2023-12-31 --processes 8 -o scores.csv
+
+DAYS_PER_SHARD = 32
+ROWS_PER_SHARD = 1 << 16
+POOL_MIN_ELEMENTS = 1 << 24  # charging values over all days above which shards go to a process pool
+
+Backtest = namedtuple("Backtest", ["scores", "emissions", "best_case", "worst_case"])
+
+
+# An array in a new shared memory buffer, which workers attach by spec without copying it. The
+# creating process owns the buffer and close() releases it; no views of array may outlive that.
+class SharedArray:
+    def __init__(self, shape, dtype):
+        dtype = np.dtype(dtype)
+        self._shm = SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+        self.array = np.ndarray(shape, dtype, buffer=self._shm.buf)
+        self.spec = (self._shm.name, tuple(shape), dtype.str)
+
+    @classmethod
+    def copy_of(cls, array):
+        shared = cls(array.shape, array.dtype)
+        shared.array[...] = array
+        return shared
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.array is not None:
+            self.array = None
+            self._shm.close()
+            self._shm.unlink()
+
+
+def _attach(spec):
+    name, shape, dtype = spec
+    # The creating process owns and unlinks the buffer, so attaching must not register it with the
+    # resource tracker; before Python 3.13 that takes silencing the registration
+    try:
+        shm = SharedMemory(name=name, track=False)
+    except TypeError:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            shm = SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+    return shm, np.ndarray(shape, np.dtype(dtype), buffer=shm.buf)
+
+
+# Emissions and scenarios of days [d0, d1) for charging rows [r0, r1), written into out
+def _score_shard(charging, intensities, zone_ids, out, d0, d1, r0, r1, hourly_capacity):
+    days, n_zones = d1 - d0, intensities.shape[0]
+    block = charging[r0:r1]
+    if block.shape[1] == HOURS_PER_DAY:
+        day_charging = np.broadcast_to(block, (days,) + block.shape)  # the same profile every day
+    else:
+        day_charging = block[:, d0 * HOURS_PER_DAY:d1 * HOURS_PER_DAY].reshape(len(block), days, -1).swapaxes(0, 1)
+    day_intensities = intensities[:, d0 * HOURS_PER_DAY:d1 * HOURS_PER_DAY].reshape(n_zones, days, -1).swapaxes(0, 1)
+    day_zone_ids = (np.arange(days)[:, None] * n_zones + zone_ids[r0:r1]).ravel()
+    results = score_companies(day_charging.reshape(days * len(block), -1), day_intensities.reshape(days * n_zones, -1),
+                              hourly_capacity, zone_ids=day_zone_ids)
+    for index, values in enumerate((results.emissions, results.best_case, results.worst_case)):
+        out[index, d0:d1, r0:r1] = values.reshape(days, -1)
+
+
+def _score_shard_shared(specs, d0, d1, r0, r1, hourly_capacity):
+    attached = [_attach(spec) for spec in specs]
+    try:
+        _score_shard(*(array for _, array in attached), d0, d1, r0, r1, hourly_capacity)
+    finally:
+        for shm, _ in attached:
+            shm.close()
+
+
+# Score a fleet on each of n_days days. charging is (rows x 24), the same profile every day, or
+# (rows x n_days * 24); intensities is (zones x n_days * 24), as an array or a SharedArray the pool
+# then uses as it is, and zone_ids gives each row's zone.
+# For multi-site fleets the rows are sites and site_companies sums them per company.
+# processes=None uses a process pool of every CPU for large runs only, processes=1 never does.
+# Returns (days x companies) score, emission and scenario series.
+def run_backtest(charging, intensities, zone_ids=None, hourly_capacity=HOURLY_CAPACITY, processes=None,
+                 site_companies=None, n_companies=None, days_per_shard=DAYS_PER_SHARD, rows_per_shard=ROWS_PER_SHARD):
+    charging = np.atleast_2d(np.asarray(charging, dtype=np.float64))
+    shared_intensities = intensities if isinstance(intensities, SharedArray) else None
+    if shared_intensities is not None:
+        intensities = shared_intensities.array
+    intensities = np.atleast_2d(np.asarray(intensities))
+    if not np.issubdtype(intensities.dtype, np.floating):
+        intensities = intensities.astype(np.float64)  # float32 stays float32, shards score in float64
+    n_rows, n_days = charging.shape[0], intensities.shape[1] // HOURS_PER_DAY
+    if intensities.shape[1] != n_days * HOURS_PER_DAY:
+        raise ValueError(f"Intensities must hold whole days of {HOURS_PER_DAY} hours, got {intensities.shape[1]}.")
+    if charging.shape[1] not in (HOURS_PER_DAY, n_days * HOURS_PER_DAY):
+        raise ValueError(f"Charging must hold {HOURS_PER_DAY} hours (the same every day) or the "
+                         f"{n_days * HOURS_PER_DAY} hours of all {n_days} days, got {charging.shape[1]}.")
+    if zone_ids is None:
+        zone_ids = default_zone_ids(len(intensities), n_rows)
+    zone_ids = np.asarray(zone_ids, dtype=np.intp)
+    shards = [(d0, min(d0 + days_per_shard, n_days), r0, min(r0 + rows_per_shard, n_rows))
+              for d0 in range(0, n_days, days_per_shard) for r0 in range(0, n_rows, rows_per_shard)]
+    if processes is None:
+        processes = os.cpu_count() if n_days * n_rows * HOURS_PER_DAY >= POOL_MIN_ELEMENTS else 1
+
+    with metrics.stage("backtest"):
+        if processes > 1 and len(shards) > 1:
+            buffers = [SharedArray.copy_of(charging), shared_intensities or SharedArray.copy_of(intensities),
+                       SharedArray.copy_of(zone_ids), SharedArray((3, n_days, n_rows), np.float64)]
+            try:
+                specs = [buffer.spec for buffer in buffers]
+                with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+                    futures = [pool.submit(_score_shard_shared, specs, *shard, hourly_capacity) for shard in shards]
+                    for future in futures:
+                        future.result()
+                out = buffers[-1].array.copy()
+            finally:
+                for buffer in buffers:
+                    if buffer is not shared_intensities:  # the caller's to close
+                        buffer.close()
+        else:
+            out = np.zeros((3, n_days, n_rows))
+            for shard in shards:
+                _score_shard(charging, intensities, zone_ids, out, *shard, hourly_capacity)
+
+    emissions, best_case, worst_case = out
+    if site_companies is not None:
+        n_companies = n_companies or int(np.max(site_companies)) + 1
+        emissions, best_case, worst_case = (sum_sites(values, site_companies, n_companies)
+                                            for values in (emissions, best_case, worst_case))
+    results = score_from_totals(emissions, None, best_case, worst_case)
+    return Backtest(results.score, emissions, best_case, worst_case)
+
+
+# (zones x hours) intensities of every day from start to end, backfilling missing days into the store;
+# read into out (e.g. a SharedArray's array of the store's dtype) when given
+def load_intensities(store, zones, start, end, out=None):
+    store.backfill(zones, start, end)
+    intensities = store.matrix(zones, start, end, out=out)
+    for zone, row in zip(zones, intensities):
+        if np.isnan(row).any():
+            raise ValueError(f"No complete carbon intensity history for {zone} from {start} to {end}.")
+    return intensities
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backtest a fleet's daily scores over a date range in parallel.")
+    parser.add_argument("charging", help="charging CSV or Parquet file, one day or one row per hour of the range")
+    parser.add_argument("--zones", nargs="+", help="one zone for all companies, or one per company")
+    parser.add_argument("--start", type=parse_date, required=True, help="first day (YYYY-MM-DD)")
+    parser.add_argument("--end", type=parse_date, required=True, help="last day (YYYY-MM-DD)")
+    parser.add_argument("--capacity", type=float, default=HOURLY_CAPACITY, help="hourly charging capacity in kW")
+    parser.add_argument("--resolution", type=int, default=60, help="minutes per row of the charging file")
+    parser.add_argument("--store", default=STORE_DIR, help="history store directory")
+    parser.add_argument("--processes", type=int, nargs="+", default=[os.cpu_count()],
+                        help="worker processes; several values time each and report the speedup")
+    parser.add_argument("-o", "--output", help="time series CSV to write (default: stdout)")
+    args = parser.parse_args(argv)
+
+    companies, charging, site_zones = load_charging(args.charging, slot_minutes=args.resolution)
+    charging = resample(charging, args.resolution, 60)
+    site_companies = None
+    if site_zones is not None:
+        companies, zones, site_companies, zone_ids = encode_sites(companies, site_zones)
+    elif args.zones and len(args.zones) in (1, len(companies)):
+        zones = list(args.zones)
+        zone_ids = default_zone_ids(len(zones), len(companies))
+    else:
+        raise ValueError("Give one zone for all companies or one per company with --zones.")
+    n_hours = ((args.end - args.start).days + 1) * HOURS_PER_DAY
+    with SharedArray((len(zones), n_hours), STORE_DTYPE) as intensities:
+        load_intensities(HistoryStore(args.store), zones, args.start, args.end, out=intensities.array)
+        baseline = None
+        for processes in args.processes:
+            started = time.perf_counter()
+            result = run_backtest(charging, intensities, zone_ids, args.capacity, processes, site_companies,
+                                  len(companies))
+            seconds = time.perf_counter() - started
+            baseline = baseline or seconds
+            print(f"{processes} process(es): {seconds:.2f} s, speedup x{baseline / seconds:.2f}", file=sys.stderr)
+
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        writer = csv.writer(output)
+        writer.writerow(["Date", "Company", "Score", "Emissions (gCO2)", "Best Case (gCO2)", "Worst Case (gCO2)"])
+        for d in range(result.scores.shape[0]):
+            day = (args.start + timedelta(days=d)).isoformat()
+            writer.writerows(zip([day] * len(companies), companies, result.scores[d], result.emissions[d],
+                                 result.best_case[d], result.worst_case[d]))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+import argparse
+import sys
+from contextlib import ExitStack
+
+import numpy as np
+
+from export import (HOURLY_COLUMNS, RANKING_COLUMNS, ROW_GROUP_ROWS, SCENARIO_COLUMNS, company_energy, hourly_table,
+                    open_table, ranking_table, scenario_table)
+from ingestion import load_charging
+from instrumentation import metrics
+from history_store import HistoryStore
+from intensity_cache import CACHE_PATH, IntensityCache
+from pipeline import iter_days, parse_date, stream_scores
+from ranking import rank_slice
+from resampling import slots_per_day
+from scoring import HOURLY_CAPACITY, default_zone_ids, encode_sites
+
+# Headless batch scoring for scheduled jobs.
+# Scores the companies of one or more charging files against the carbon intensities of the given
+# zones (or, for multi-site files with a Zone column, of each site's zone) for every day of a date
+# range and writes the ranking, and optionally hourly emissions and scenario breakdowns, as CSV or
+# Parquet tables streamed a row group at a time. Only numpy and the scoring modules are imported
+# (pyarrow too for Parquet), so it starts quickly and never touches Streamlit or matplotlib.
+#
+#   python batch.py fleet_a.csv fleet_b.csv --zones DE IT PT --start 2024-07-01 --end 2024-07-07 -o ranking.csv
+#   python batch.py multi_site.csv --start 2024-07-01 -o ranking.csv
+#   python batch.py fleets/*.parquet --zones DE --start 2024-01-01 --end 2024-12-31 -o ranking.parquet \
+#       --hourly hourly.parquet --scenarios scenarios.parquet
+
+# Company i charges in zones[i], or every company in zones[0] when a single zone is given
+def assign_zones(companies, zones):
+    if len(zones) not in (1, len(companies)):
+        raise ValueError(f"Got {len(zones)} zones for {len(companies)} companies; give one zone or one per company.")
+    return default_zone_ids(len(zones), len(companies))
+
+
+# Zone label of every company of a multi-site fleet, e.g. "DE+FR" for a company with sites in both
+def site_zone_labels(zones, site_companies, site_zones, n_companies):
+    labels = [[] for _ in range(n_companies)]
+    for company, zone in zip(site_companies, site_zones):
+        labels[company].append(zones[zone])
+    return ["+".join(sorted(set(company_zones))) for company_zones in labels]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Score EV charging profiles against grid carbon intensity.")
+    parser.add_argument("charging", nargs="+", help="charging CSV or Parquet file(s), one fleet per file")
+    parser.add_argument("--zones", nargs="+", help="one zone for all companies, or one per company "
+                                                   "(not needed for files with a Zone column)")
+    parser.add_argument("--start", type=parse_date, required=True, help="first day (YYYY-MM-DD)")
+    parser.add_argument("--end", type=parse_date, help="last day (YYYY-MM-DD), defaults to --start")
+    parser.add_argument("--capacity", type=float, default=HOURLY_CAPACITY, help="hourly charging capacity in kW")
+    parser.add_argument("--resolution", type=int, default=60, help="minutes per row of the charging files")
+    parser.add_argument("--cache", default=CACHE_PATH, help="intensity cache file")
+    parser.add_argument("--store", help="memory-mapped history store directory to read and extend")
+    selection = parser.add_mutually_exclusive_group()
+    selection.add_argument("--top", type=int, help="only write the k best companies of each day")
+    selection.add_argument("--bottom", type=int, help="only write the k worst companies of each day")
+    parser.add_argument("-o", "--output", help="ranking CSV or Parquet file to write (default: CSV on stdout)")
+    parser.add_argument("--hourly", help="also write every company's hourly emissions to this CSV or Parquet file")
+    parser.add_argument("--scenarios", help="also write every company's scenario breakdown to this CSV or "
+                                            "Parquet file")
+    parser.add_argument("--row-group-rows", type=int, default=ROW_GROUP_ROWS,
+                        help="rows buffered per write (and per Parquet row group)")
+    parser.add_argument("--metrics", help="write per-stage timings and cache hit ratios to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    end = args.end or args.start
+    zones = list(args.zones or [])
+    cache = IntensityCache(args.cache)
+    store = HistoryStore(args.store) if args.store else None
+    with ExitStack() as stack:
+        rankings = stack.enter_context(open_table(args.output, RANKING_COLUMNS, args.row_group_rows))
+        hourly, scenarios = (stack.enter_context(open_table(path, columns, args.row_group_rows)) if path else None
+                             for path, columns in ((args.hourly, HOURLY_COLUMNS), (args.scenarios, SCENARIO_COLUMNS)))
+        for path in args.charging:
+            companies, charging, site_zones = load_charging(path, slot_minutes=args.resolution)
+            if charging.shape[1] != slots_per_day(args.resolution):
+                raise ValueError(f"{path}: expected {slots_per_day(args.resolution)} rows of "
+                                 f"{args.resolution}-minute charging data, got {charging.shape[1]}.")
+            if site_zones is not None:
+                companies, fleet_zones, site_companies, zone_ids = encode_sites(companies, site_zones)
+                company_zones = site_zone_labels(fleet_zones, site_companies, zone_ids, len(companies))
+            elif zones:
+                fleet_zones, site_companies, zone_ids = zones, None, assign_zones(companies, zones)
+                company_zones = [zones[zone] for zone in zone_ids]
+            else:
+                raise ValueError(f"{path} has no Zone column; give the companies' zones with --zones.")
+            companies, company_zones = np.array(companies, dtype=object), np.array(company_zones, dtype=object)
+            energy = company_energy(charging, args.resolution, site_companies, len(companies)) if scenarios else None
+            for day, results in stream_scores(charging, fleet_zones, iter_days(args.start, end), zone_ids=zone_ids,
+                                              cache=cache, hourly_capacity=args.capacity,
+                                              slot_minutes=args.resolution, site_companies=site_companies,
+                                              n_companies=len(companies), store=store):
+                if results is None:
+                    print(f"{path}: no complete carbon intensity data on {day}, skipped.", file=sys.stderr)
+                    continue
+                if args.top or args.bottom:
+                    start, stop = (0, args.top) if args.top else (len(companies) - args.bottom, len(companies))
+                    rows = rank_slice(results.score, start, stop)
+                    ranks = np.arange(max(start, 0) + 1, max(start, 0) + 1 + len(rows))
+                else:
+                    rows = np.arange(len(companies))
+                    ranks = np.empty(len(companies), dtype=np.intp)
+                    ranks[np.argsort(results.score, kind="stable")] = np.arange(1, len(companies) + 1)
+                rankings.write(ranking_table(path, day, companies, company_zones, results, rows, ranks))
+                if hourly is not None:
+                    hourly.write(hourly_table(path, day, companies, company_zones, results, args.resolution))
+                if scenarios is not None:
+                    scenarios.write(scenario_table(path, day, companies, company_zones, results, energy))
+    if args.metrics:
+        with open(args.metrics, "w") as f:
+            f.write(metrics.to_json())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+import api_stub
+import carbon_api
+from ingestion import load_charging
+from resampling import resample
+from scheduler import optimal_schedule
+from scoring import IntensityIndex, calculate_daily_emissions, calculate_scenarios, score_companies
+
+# Benchmarks of the scoring and ingestion hot paths on synthetic fleets.
+# Fleets are drawn like the app's default_charging_values (0-12 kW per hour) at any size and
+# horizon, each stage is timed and its peak traced memory recorded, and every run is appended to a
+# JSON-lines history tagged with the git revision so regressions show up between versions.
+#
+#   python benchmark.py --sizes 1000 100000 1000000 --days 1 7 --compare
+
+HISTORY_PATH = "bench_history.jsonl"
+ZONES = 5
+SCALAR_LOOP_MAX = 10000  # the per-company reference loop is only timed up to this size
+INGEST_MAX_ROWS = 5_000_000
+FETCH_PAIRS = 500  # zone/day requests served by the local API stand-in per fetch run
+REGRESSION_THRESHOLD = 1.2  # flag stages more than 20% slower than the previous run
+
+
+# Synthetic fleet: (companies x hours) charging, (zones x hours) intensities and a zone per company
+def synthetic_fleet(n_companies, days=1, zones=ZONES, seed=0):
+    rng = np.random.default_rng(seed)
+    hours = 24 * days
+    charging = rng.integers(0, 13, (n_companies, hours)).astype(np.float32)
+    intensities = rng.uniform(50, 600, (zones, hours)).astype(np.float32)
+    zone_ids = rng.integers(0, zones, n_companies)
+    return charging, intensities, zone_ids
+
+
+def _measure(fn, repeat, warmup=False):
+    if warmup:
+        fn()  # pay one-off costs such as lazy imports outside the timings
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    # tracemalloc slows allocations down, so peak memory is taken from a separate run
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def _scalar_loop(charging, intensities, zone_ids):
+    for i in range(charging.shape[0]):
+        calculate_daily_emissions(charging[i], intensities[zone_ids[i]])
+        calculate_scenarios(np.sum(charging[i]), intensities[zone_ids[i]])
+
+
+def _score_days(charging, intensities, zone_ids):
+    for day in range(charging.shape[1] // 24):
+        hours = slice(24 * day, 24 * (day + 1))
+        score_companies(charging[:, hours], intensities[:, hours], zone_ids=zone_ids)
+
+
+# Long CSV of a (companies x days * 24) charging matrix with a Date column, one row per company and hour
+def _write_long_csv(path, charging):
+    n_companies, hours = charging.shape
+    with open(path, "w") as f:
+        f.write("Company,Date,Hour,Charging (kW)\n")
+        company = np.repeat(np.arange(n_companies), hours).astype(str)
+        dates = np.datetime_as_string(np.datetime64("2024-01-01") + np.arange(hours) // 24)
+        hour = np.tile(np.arange(hours) % 24, n_companies).astype(str)
+        np.savetxt(f, np.column_stack([np.char.add("C", company), np.tile(dates, n_companies), hour,
+                                       charging.ravel().astype(str)]), fmt="%s", delimiter=",")
+
+
+# Fetch FETCH_PAIRS synthetic zone/day histories from an in-process api_stub server, bypassing caches
+# and the rate limit
+def _fetch_stub(base_url):
+    carbon_api.configure(base_url=base_url, rate_limit=0)
+    pairs = [(f"Z{i}", datetime(2024, 1, 1 + i % 28).date()) for i in range(FETCH_PAIRS)]
+    return carbon_api.fetch_many(pairs)
+
+
+# Time every stage for one fleet size and horizon, returning one record per stage
+def run_stages(n_companies, days, repeat):
+    charging, intensities, zone_ids = synthetic_fleet(n_companies, days)
+    day_charging, day_intensities = charging[:, :24], intensities[:, :24]
+    stages = {
+        "index": lambda: IntensityIndex(day_intensities),
+        "score": lambda: _score_days(charging, intensities, zone_ids),
+        "schedule": lambda: optimal_schedule(day_charging.sum(axis=1), day_intensities, zone_ids=zone_ids),
+        "resample_5min": lambda: resample(day_charging, 60, 5),
+    }
+    if n_companies <= SCALAR_LOOP_MAX and days == 1:
+        stages["scalar_loop"] = lambda: _scalar_loop(day_charging, day_intensities, zone_ids)
+
+    records = []
+    for stage, fn in stages.items():
+        seconds, peak = _measure(fn, repeat)
+        records.append({"stage": stage, "companies": n_companies, "days": days, "seconds": seconds,
+                        "companies_per_second": n_companies * days / seconds, "peak_bytes": peak})
+
+    if charging.size <= INGEST_MAX_ROWS:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "fleet.csv")
+            _write_long_csv(path, charging)
+            # the first load is also the warm-up run; every day must land in its own 24 columns
+            loaded = load_charging(path).charging.shape
+            assert loaded == charging.shape, f"ingest_csv loaded {loaded}, expected {charging.shape}"
+            seconds, peak = _measure(lambda: load_charging(path), repeat)
+            records.append({"stage": "ingest_csv", "companies": n_companies, "days": days, "seconds": seconds,
+                            "companies_per_second": n_companies * days / seconds, "peak_bytes": peak,
+                            "file_bytes": os.path.getsize(path)})
+    return records
+
+
+# Time the fetch layer against an in-process api_stub server, counting each request as a company
+def run_fetch(repeat):
+    server, base_url = api_stub.start_in_thread()
+    try:
+        seconds, peak = _measure(lambda: _fetch_stub(base_url), repeat, warmup=True)
+    finally:
+        server.shutdown()
+    return {"stage": "fetch_stub", "companies": FETCH_PAIRS, "days": 1, "seconds": seconds,
+            "companies_per_second": FETCH_PAIRS / seconds, "peak_bytes": peak}
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _load_previous(path):
+    if not os.path.exists(path):
+        return {}
+    previous = {}
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            previous[(record["stage"], record["companies"], record["days"])] = record
+    return previous
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the scoring and ingestion hot paths.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000, 100000], help="fleet sizes")
+    parser.add_argument("--days", nargs="+", type=int, default=[1, 7], help="horizons in days")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the fastest is kept")
+    parser.add_argument("--history", default=HISTORY_PATH, help="JSON-lines file the results are appended to")
+    parser.add_argument("--fetch", action="store_true", help="also time the fetch layer against api_stub")
+    parser.add_argument("--compare", action="store_true", help="compare with the last recorded run of each stage")
+    args = parser.parse_args(argv)
+
+    previous = _load_previous(args.history) if args.compare else {}
+    revision, timestamp = _git_revision(), datetime.now().isoformat(timespec="seconds")
+    regressions = 0
+    with open(args.history, "a") as history:
+        print(f"{'stage':<14}{'companies':>10}{'days':>6}{'seconds':>12}{'companies/s':>14}{'peak MB':>10}")
+        runs = (run_stages(n_companies, days, args.repeat) for days in args.days for n_companies in args.sizes)
+        if args.fetch:
+            runs = itertools.chain([[run_fetch(args.repeat)]], runs)
+        for records in runs:
+            for record in records:
+                n_companies, days = record["companies"], record["days"]
+                record.update(revision=revision, timestamp=timestamp)
+                history.write(json.dumps(record) + "\n")
+                line = (f"{record['stage']:<14}{n_companies:>10}{days:>6}{record['seconds']:>12.4f}"
+                        f"{record['companies_per_second']:>14.0f}{record['peak_bytes'] / 1e6:>10.1f}")
+                before = previous.get((record["stage"], n_companies, days))
+                if before is not None:
+                    ratio = record["seconds"] / before["seconds"]
+                    line += f"  x{ratio:.2f} vs {before['revision']}"
+                    if ratio > REGRESSION_THRESHOLD:
+                        line += "  REGRESSION"
+                        regressions += 1
+                print(line, flush=True)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from instrumentation import metrics
+from request_scheduler import INTERACTIVE, LIVE, RequestScheduler
+
+# Fetch layer for the ElectricityMaps carbon intensity history.
+# All requests go through one shared keep-alive session, every request has a timeout and is
+# retried with exponential backoff on connection errors, rate limiting and server errors, and
+# many (zone, date) pairs are fetched concurrently so a page waits for the slowest request only.
+# requests is imported on first use so cached runs and headless jobs do not pay for it.
+# The base URL and token come from ELECTRICITYMAPS_API_URL / ELECTRICITYMAPS_API_TOKEN, so the
+# app can be pointed at the local stand-in server in api_stub.py for offline runs.
+# Requests of all sessions of the process pass through one RequestScheduler: a token bucket of
+# ELECTRICITYMAPS_RATE_LIMIT requests per second (0 disables it) served by priority, and
+# single-flight fetches, so analysts opening the same zones and day share one request.
+
+HISTORY_PATH = "/v3/carbon-intensity/history"
+PAST_RANGE_PATH = "/v3/carbon-intensity/past-range"
+DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+API_BASE_URL = os.environ.get("ELECTRICITYMAPS_API_URL", "https://api.electricitymap.org").rstrip("/")
+API_URL = API_BASE_URL + HISTORY_PATH
+API_TOKEN = os.environ.get("ELECTRICITYMAPS_API_TOKEN", "YOUR_API_TOKEN")  # Replace with your API token
+REQUEST_TIMEOUT = 10  # seconds
+MAX_RETRIES = 3
+BACKOFF_SECONDS = 0.5
+MAX_WORKERS = 32
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT = float(os.environ.get("ELECTRICITYMAPS_RATE_LIMIT", 30))  # requests per second
+BURST = MAX_WORKERS
+
+scheduler = RequestScheduler(RATE_LIMIT or None, BURST)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+# Point the fetch layer at another server and/or token, or change the rate limit (0 disables it);
+# the next request opens a new session
+def configure(base_url=None, token=None, rate_limit=None, burst=None):
+    global API_BASE_URL, API_URL, API_TOKEN, _session
+    if rate_limit is not None or burst is not None:
+        scheduler.configure(scheduler.rate if rate_limit is None else rate_limit or None, burst)
+    with _session_lock:
+        if base_url is not None:
+            API_BASE_URL = base_url.rstrip("/")
+            API_URL = API_BASE_URL + HISTORY_PATH
+        if token is not None:
+            API_TOKEN = token
+        _session = None
+
+
+# Return the process-wide HTTP session, creating its connection pool on first use
+def get_session():
+    global _session
+    import requests
+    from requests.adapters import HTTPAdapter
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_WORKERS)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({"auth-token": API_TOKEN})
+            _session = session
+    return _session
+
+
+def _retry_delay(response, attempt):
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after is not None and retry_after.isdigit():
+        return float(retry_after)
+    return BACKOFF_SECONDS * (2 ** attempt)
+
+
+# GET url with params once the scheduler hands out a token, retrying connection errors, rate
+# limiting and server errors with backoff; a 429 holds the scheduler for every other request too.
+# Returns the decoded JSON body, or None when the request keeps failing or the body is not JSON.
+def _get_json(url, params, priority=INTERACTIVE):
+    import requests
+    session = get_session()
+    for attempt in range(MAX_RETRIES + 1):
+        response = None
+        scheduler.acquire(priority)
+        try:
+            with metrics.stage("api_request"):
+                response = session.get(url, params=params, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException:
+            pass
+        if response is not None and response.status_code == 200:
+            with metrics.stage("json_parse"):
+                try:
+                    return response.json()
+                except ValueError:
+                    return None
+        if response is not None and response.status_code not in RETRY_STATUSES:
+            break
+        if response is not None and response.status_code == 429:
+            scheduler.hold(_retry_delay(response, attempt))  # the next token waits out the quota
+        elif attempt < MAX_RETRIES:
+            time.sleep(_retry_delay(response, attempt))
+    return None
+
+
+# Function to fetch carbon intensities for a specific zone on the selected day.
+# Returns an empty list when the history cannot be fetched.
+def fetch_carbon_intensities(zone, date, cache=None, priority=INTERACTIVE):
+    if cache is not None:
+        cached = cache.get(zone, date)
+        if cached is not None:
+            return cached
+
+    def fetch():
+        data = _get_json(API_URL, {"zone": zone, "date": date.strftime('%Y-%m-%d')}, priority)
+        try:
+            values = [entry["carbonIntensity"] for entry in data["history"]]
+        except (KeyError, TypeError):
+            return []  # no response, or one without the expected history
+        if cache is not None:
+            cache.put(zone, date, values)
+        return values
+
+    return list(scheduler.single_flight((zone, date.strftime('%Y-%m-%d')), fetch))
+
+
+# Fetch only the hours of a zone from start (inclusive) to end (exclusive), naive UTC datetimes,
+# e.g. the hours published since the last poll. Returns a list of (datetime, intensity) in time
+# order, or None when the request failed (as opposed to [] when there is nothing new yet).
+def fetch_intensity_range(zone, start, end, priority=LIVE):
+    params = {"zone": zone, "start": start.strftime(DATETIME_FORMAT), "end": end.strftime(DATETIME_FORMAT)}
+    data = _get_json(API_BASE_URL + PAST_RANGE_PATH, params, priority)
+    entries = []
+    try:
+        for entry in data.get("data", []):
+            hour = datetime.strptime(entry["datetime"][:19], "%Y-%m-%dT%H:%M:%S")
+            if start <= hour < end:
+                entries.append((hour, entry["carbonIntensity"]))
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None  # no response, or one without the expected entries
+    return sorted(entries)
+
+
+# Fetch every (zone, date) pair concurrently, returning {(zone, date): intensities}
+def fetch_many(pairs, cache=None, max_workers=MAX_WORKERS, priority=INTERACTIVE):
+    pairs = list(dict.fromkeys(pairs))
+    if len(pairs) == 0:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(pairs))) as executor:
+        results = executor.map(lambda pair: fetch_carbon_intensities(pair[0], pair[1], cache, priority), pairs)
+        return dict(zip(pairs, results))
@@ -0,0 +1,70 @@
+import io
+
+from matplotlib.figure import Figure
+
+from instrumentation import timed
+
+# Chart rendering for the carbon intensity plots and the capacity sensitivity curves.
+# Figures are built with matplotlib.figure.Figure instead of pyplot, so they are never registered
+# in pyplot's global figure manager and are freed as soon as the PNG bytes have been written.
+# The app caches the returned bytes, so an unchanged chart is not rasterised again.
+
+FIGURE_SIZE = (10, 5)
+DPI = 100
+
+
+def _to_png(fig):
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=DPI)
+    fig.clear()
+    return buffer.getvalue()
+
+
+def _draw_zone(ax, zone, values):
+    ax.bar(range(len(values)), values, color='blue')
+    ax.set_title(f"Carbon Intensity for {zone}")
+    ax.set_xlabel("Hour")
+    ax.set_ylabel("Carbon Intensity (gCO2/kWh)")
+
+
+# Bar chart of one zone's hourly carbon intensity as PNG bytes
+@timed("render_chart")
+def render_zone_chart(zone, values):
+    fig = Figure(figsize=FIGURE_SIZE)
+    _draw_zone(fig.add_subplot(), zone, values)
+    fig.tight_layout()
+    return _to_png(fig)
+
+
+# One figure with a bar chart per zone, sharing the hour and intensity axes, as PNG bytes
+@timed("render_chart")
+def render_zone_facets(intensities):
+    zones = list(intensities)
+    fig = Figure(figsize=(FIGURE_SIZE[0], 0.6 * FIGURE_SIZE[1] * max(len(zones), 1)))
+    axes = fig.subplots(max(len(zones), 1), 1, sharex=True, sharey=True, squeeze=False)[:, 0]
+    for ax, zone in zip(axes, zones):
+        _draw_zone(ax, zone, intensities[zone])
+    fig.tight_layout()
+    return _to_png(fig)
+
+
+# Score against hourly capacity on a log axis: one line per company in curves ({label: scores}) and,
+# when band is given as (low, median, high) arrays, the spread of the whole fleet behind them
+@timed("render_chart")
+def render_capacity_sweep(capacities, curves, band=None):
+    fig = Figure(figsize=FIGURE_SIZE)
+    ax = fig.add_subplot()
+    if band is not None:
+        low, median, high = band
+        ax.fill_between(capacities, low, high, color='grey', alpha=0.2, label="Fleet 10th–90th percentile")
+        ax.plot(capacities, median, color='grey', linestyle='--', label="Fleet median")
+    for label, scores in curves.items():
+        ax.plot(capacities, scores, label=label)
+    ax.set_xscale('log')
+    ax.set_title("Score Sensitivity to Hourly Charging Capacity")
+    ax.set_xlabel("Hourly Capacity (kW)")
+    ax.set_ylabel("Score (0 = best case, 1 = worst case)")
+    if curves or band is not None:
+        ax.legend(loc='best', fontsize='small')
+    fig.tight_layout()
+    return _to_png(fig)
@@ -0,0 +1,146 @@
+import csv
+import sys
+
+import numpy as np
+
+from instrumentation import metrics
+from resampling import slots_per_day
+from scoring import sum_sites
+
+# Streaming report export.
+# Rankings, hourly emissions and scenario breakdowns are written as long tables, CSV or Parquet by
+# file extension. Callers hand over whole columns (one numpy array per column, e.g. every company
+# of a fleet on one day) and TableWriter writes them in row groups of row_group_rows rows, sliced
+# straight from the arrays handed over; only the tail short of a full group is copied and kept.
+# Memory is thus bounded by one write (a fleet-day) plus one row group however many fleets and
+# days are exported, and Parquet files get evenly sized row groups for the warehouse to scan.
+
+ROW_GROUP_ROWS = 1 << 17
+
+RANKING_COLUMNS = [
+    "Fleet", "Date", "Company", "Zone", "Rank", "Score", "Emissions (gCO2)",
+    "Best Case (gCO2)", "Worst Case (gCO2)", "% away from Best Scenario", "% away from Worst Scenario",
+]
+HOURLY_COLUMNS = ["Fleet", "Date", "Company", "Zone", "Slot", "Emissions (gCO2)"]
+SCENARIO_COLUMNS = [
+    "Fleet", "Date", "Company", "Zone", "Energy (kWh)", "Emissions (gCO2)", "Best Case (gCO2)",
+    "Worst Case (gCO2)", "Avoidable Emissions (gCO2)", "Average Intensity (gCO2/kWh)",
+]
+
+
+def table_format(path):
+    return "parquet" if str(path).lower().endswith((".parquet", ".pq")) else "csv"
+
+
+class TableWriter:
+    # target is a path, or an open text file for CSV; the format follows the path's extension
+    def __init__(self, target, columns, fmt=None, row_group_rows=ROW_GROUP_ROWS):
+        self.columns = list(columns)
+        self.fmt = fmt or (table_format(target) if isinstance(target, str) else "csv")
+        self.row_group_rows = row_group_rows
+        self.rows = 0  # rows written so far
+        self._target = target
+        self._file = None
+        self._writer = None
+        self._pending = []  # buffered column lists (copies), fewer than row_group_rows rows in all
+        self._pending_rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Append rows given as one array per column; scalars are repeated over the rows
+    def write(self, values):
+        n = max((len(value) for value in values if np.ndim(value)), default=1)
+        values = [np.asarray(value) if np.ndim(value) else np.full(n, value, dtype=object) for value in values]
+        start = 0
+        if self._pending_rows:
+            # complete the buffered group first; the buffer never reaches a full group on its own
+            start = min(self.row_group_rows - self._pending_rows, n)
+            self._pending.append([value[:start].copy() for value in values])
+            self._pending_rows += start
+            if self._pending_rows < self.row_group_rows:
+                return
+            self._write_group(self._take_pending())
+        while n - start >= self.row_group_rows:
+            self._write_group([value[start:start + self.row_group_rows] for value in values])
+            start += self.row_group_rows
+        if start < n:
+            self._pending.append([value[start:].copy() for value in values])
+            self._pending_rows = n - start
+
+    # The buffered rows as one array per column, emptying the buffer
+    def _take_pending(self):
+        columns = [np.concatenate(parts) for parts in zip(*self._pending)]
+        self._pending, self._pending_rows = [], 0
+        return columns
+
+    def _write_group(self, columns):
+        with metrics.stage("export_write"):
+            if self.fmt == "parquet":
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+                if self._writer is None:
+                    table = pa.Table.from_arrays([pa.array(column) for column in columns], names=self.columns)
+                    self._writer = pq.ParquetWriter(self._target, table.schema)
+                else:
+                    table = pa.Table.from_arrays([pa.array(column) for column in columns],
+                                                 schema=self._writer.schema)
+                self._writer.write_table(table, row_group_size=len(table))
+            else:
+                if self._writer is None:
+                    if isinstance(self._target, str):
+                        self._file = open(self._target, "w", newline="")
+                    self._writer = csv.writer(self._file or self._target)
+                    self._writer.writerow(self.columns)
+                self._writer.writerows(zip(*(column.tolist() for column in columns)))
+        self.rows += len(columns[0])
+
+    def close(self):
+        if self._pending_rows:
+            self._write_group(self._take_pending())
+        elif self._writer is None and self.fmt == "csv":
+            self._write_group([np.empty(0) for _ in self.columns])  # header only
+        if self.fmt == "parquet" and self._writer is not None:
+            self._writer.close()
+        if self._file is not None:
+            self._file.close()
+        self._writer = self._file = None
+
+
+# Columns of the ranking rows of one fleet and day; rows are the companies to write and ranks theirs
+def ranking_table(fleet, day, companies, company_zones, results, rows, ranks):
+    return [fleet, day.isoformat(), companies[rows], company_zones[rows], ranks, results.score[rows],
+            results.emissions[rows], results.best_case[rows], results.worst_case[rows],
+            results.percent_away_best[rows], results.percent_away_worst[rows]]
+
+
+# Columns of the hourly emissions of every company and slot of one fleet and day
+def hourly_table(fleet, day, companies, company_zones, results, slot_minutes=60):
+    n_companies, slots = results.hourly_emissions.shape
+    labels = np.array([f"{m // 60:02d}:{m % 60:02d}" for m in range(0, slots_per_day(slot_minutes) * slot_minutes,
+                                                                     slot_minutes)], dtype=object)
+    return [fleet, day.isoformat(), np.repeat(companies, slots), np.repeat(company_zones, slots),
+            np.tile(labels, n_companies), results.hourly_emissions.ravel()]
+
+
+# Columns of the scenario breakdown of one fleet and day: what each company emitted against its best
+# and worst case, the emissions a best schedule would avoid and the intensity of its charging
+def scenario_table(fleet, day, companies, company_zones, results, energy):
+    average_intensity = np.where(energy > 0, results.emissions / np.where(energy > 0, energy, 1), np.nan)
+    return [fleet, day.isoformat(), companies, company_zones, energy, results.emissions, results.best_case,
+            results.worst_case, results.emissions - results.best_case, average_intensity]
+
+
+# Daily energy of every company in kWh; for multi-site fleets the rows are sites summed per company
+def company_energy(charging, slot_minutes=60, site_companies=None, n_companies=None):
+    energy = np.asarray(charging, dtype=np.float64).sum(axis=-1) * (slot_minutes / 60)
+    if site_companies is None:
+        return energy
+    return sum_sites(energy, site_companies, n_companies)
+
+
+def open_table(path, columns, row_group_rows=ROW_GROUP_ROWS):
+    return TableWriter(path if path and path != "-" else sys.stdout, columns, row_group_rows=row_group_rows)
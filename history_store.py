@@ -0,0 +1,146 @@
+import argparse
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from carbon_api import fetch_many
+from instrumentation import metrics
+from pipeline import parse_date
+from request_scheduler import BACKGROUND
+from resampling import HOURS_PER_DAY
+
+# Memory-mapped historical intensity store for multi-year, multi-zone analysis.
+# Every zone has one contiguous float32 file of hourly intensities starting at EPOCH, so the
+# offset of any hour is known without an index and NaN marks hours not stored yet. Files are
+# memory-mapped: slicing a date range returns a zero-copy view whose pages are read on demand, so
+# years of history can be scored without loading them into RAM. Backfill fetches the missing
+# days in concurrent chunks and writes them in place, growing the files as needed. One writer
+# at a time is assumed; any number of readers can map the files.
+#
+#   python history_store.py --zones DE FR IT PT --start 2021-01-01 --end 2024-12-31
+
+STORE_DIR = ".intensity_history"
+EPOCH = date(2015, 1, 1)
+DTYPE = np.float32
+BACKFILL_CHUNK_DAYS = 31
+
+
+class HistoryStore:
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._maps = {}  # zone -> read-only memmap, dropped when the file grows
+
+    def _path(self, zone):
+        return os.path.join(self.root, f"{zone}.f32")
+
+    @staticmethod
+    def _offset(day):
+        return (day - EPOCH).days * HOURS_PER_DAY
+
+    def zones(self):
+        return sorted(name[:-4] for name in os.listdir(self.root) if name.endswith(".f32"))
+
+    # Number of hours stored for a zone, from EPOCH up to the last written hour
+    def hours(self, zone):
+        path = self._path(zone)
+        return os.path.getsize(path) // DTYPE().itemsize if os.path.exists(path) else 0
+
+    def _map(self, zone):
+        mapped = self._maps.get(zone)
+        if mapped is None or len(mapped) != self.hours(zone):
+            if self.hours(zone) == 0:
+                return np.empty(0, dtype=DTYPE)
+            mapped = self._maps[zone] = np.memmap(self._path(zone), dtype=DTYPE, mode="r")
+        return mapped
+
+    # Hourly intensities of a zone from start to end (both days included). A zero-copy view of the
+    # mapped file when the range is stored, otherwise a copy padded with NaN (e.g. before EPOCH).
+    def read(self, zone, start, end):
+        begin, stop = self._offset(start), self._offset(end) + HOURS_PER_DAY
+        mapped = self._map(zone)
+        if 0 <= begin and stop <= len(mapped):
+            return mapped[begin:stop]
+        values = np.full(max(stop - begin, 0), np.nan, dtype=DTYPE)
+        first, last = max(begin, 0), min(stop, len(mapped))
+        if first < last:
+            values[first - begin:last - begin] = mapped[first:last]
+        return values
+
+    # (zones x hours) matrix of a date range; this stacks the zones and so copies the range, into out
+    # (e.g. a shared memory buffer) when given
+    def matrix(self, zones, start, end, out=None):
+        return np.stack([self.read(zone, start, end) for zone in zones], out=out)
+
+    # One day of a zone, or None unless all of its hours are stored
+    def day(self, zone, day):
+        values = self.read(zone, day, day)
+        return None if np.isnan(values).any() else values
+
+    # Days from start to end with at least one hour missing; days before EPOCH cannot be stored
+    def missing_days(self, zone, start, end):
+        start = max(start, EPOCH)
+        if start > end:
+            return []
+        days = self.read(zone, start, end).reshape(-1, HOURS_PER_DAY)
+        return [start + timedelta(days=int(i)) for i in np.flatnonzero(np.isnan(days).any(axis=-1))]
+
+    # Write hourly values of a zone starting at the first hour of day, growing the file with NaN.
+    # Days before EPOCH are outside the store and skipped.
+    def write(self, zone, day, values):
+        values = np.asarray(values, dtype=DTYPE)
+        begin = self._offset(day)
+        if begin < 0:
+            return
+        path, size = self._path(zone), self.hours(zone)
+        if begin + len(values) > size:
+            with open(path, "ab") as f:
+                np.full(begin + len(values) - size, np.nan, dtype=DTYPE).tofile(f)
+            self._maps.pop(zone, None)
+        with metrics.stage("history_write"):
+            mapped = np.memmap(path, dtype=DTYPE, mode="r+", offset=begin * DTYPE().itemsize, shape=len(values))
+            mapped[:] = values
+            mapped.flush()
+            del mapped
+
+    # Fetch and store every day from start to end that is missing for a zone, chunk_days days of
+    # all zones at a time. Days that are not complete yet (e.g. today) are not stored. Returns
+    # the number of days written.
+    def backfill(self, zones, start, end, cache=None, chunk_days=BACKFILL_CHUNK_DAYS, progress=None):
+        pairs = [(zone, day) for zone in zones for day in self.missing_days(zone, start, end)]
+        written = 0
+        for i in range(0, len(pairs), chunk_days * max(len(zones), 1)):
+            chunk = pairs[i:i + chunk_days * max(len(zones), 1)]
+            for (zone, day), values in fetch_many(chunk, cache=cache, priority=BACKGROUND).items():
+                if len(values) == HOURS_PER_DAY and day < datetime.utcnow().date():
+                    self.write(zone, day, values)
+                    written += 1
+            if progress is not None:
+                progress(min(i + len(chunk), len(pairs)), len(pairs))
+        return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backfill the memory-mapped intensity history store.")
+    parser.add_argument("--zones", nargs="+", required=True)
+    parser.add_argument("--start", type=parse_date, required=True, help="first day (YYYY-MM-DD)")
+    parser.add_argument("--end", type=parse_date, help="last day (YYYY-MM-DD), defaults to yesterday")
+    parser.add_argument("--store", default=STORE_DIR, help="store directory")
+    args = parser.parse_args(argv)
+
+    store = HistoryStore(args.store)
+    end = args.end or datetime.utcnow().date() - timedelta(days=1)
+    written = store.backfill(args.zones, args.start, end,
+                             progress=lambda done, total: print(f"\r{done}/{total} days", end="", file=sys.stderr))
+    print(f"\nStored {written} zone-days in {args.store}.", file=sys.stderr)
+    for zone in args.zones:
+        missing = store.missing_days(zone, args.start, end)
+        if missing:
+            print(f"{zone}: {len(missing)} day(s) still missing.", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+import numpy as np
+
+from instrumentation import metrics, timed
+from scoring import HOURLY_CAPACITY, IntensityIndex, ScoreResult, score_companies
+
+# Incremental recomputation of fleet scores.
+# The inputs form a small dependency graph: each zone's intensities feed that zone's row of the
+# IntensityIndex, each company's charging vector and its zone's row feed that company's results
+# (emissions, scenarios, score, percentages). Changing an input only marks its dependents dirty;
+# the next read rescores the dirty companies in one vectorized pass and leaves every other
+# company's stored results untouched. Rankings are selected from the scores (see ranking.py).
+
+RESULT_FIELDS = ScoreResult._fields
+
+
+class FleetGraph:
+    def __init__(self, charging, intensities, zone_ids=None, hourly_capacity=HOURLY_CAPACITY, slot_hours=1.0):
+        self.charging = np.array(charging, dtype=np.float64, ndmin=2)
+        self.intensities = np.array(intensities, dtype=np.float64, ndmin=2)
+        n_companies = self.charging.shape[0]
+        self.index = IntensityIndex(self.intensities)
+        if zone_ids is None:
+            zone_ids = self.index.default_zone_ids(n_companies)
+        self.zone_ids = np.array(zone_ids, dtype=np.intp)
+        self.hourly_capacity = hourly_capacity
+        self.slot_hours = slot_hours
+
+        self._results = {field: np.zeros(self.charging.shape if field == "hourly_emissions" else n_companies)
+                         for field in RESULT_FIELDS}
+        self._dirty = np.ones(n_companies, dtype=bool)
+        self._dirty_zones = np.zeros(self.intensities.shape[0], dtype=bool)
+
+    @property
+    def shape(self):
+        return self.charging.shape, self.intensities.shape
+
+    # Diff full input matrices against the current ones and invalidate the rows that changed.
+    # Returns the number of companies marked dirty.
+    def update(self, charging, intensities=None):
+        charging = np.asarray(charging, dtype=np.float64)
+        changed = np.any(self.charging != charging, axis=-1)
+        self.charging[changed] = charging[changed]
+        self._dirty |= changed
+        if intensities is not None:
+            intensities = np.asarray(intensities, dtype=np.float64)
+            changed_zones = np.any(self.intensities != intensities, axis=-1)
+            self.intensities[changed_zones] = intensities[changed_zones]
+            self._dirty_zones |= changed_zones
+            self._dirty |= changed_zones[self.zone_ids]
+        return int(np.count_nonzero(self._dirty))
+
+    def _refresh(self):
+        if self._dirty_zones.any():
+            # An index row is a sort of one zone's slots, cheap enough to rebuild for all zones
+            self.index = IntensityIndex(self.intensities)
+            self._dirty_zones[:] = False
+        dirty = np.flatnonzero(self._dirty)
+        metrics.record_lookup("fleet_graph", hit=len(dirty) == 0)
+        if len(dirty) == 0:
+            return
+        fresh = score_companies(self.charging[dirty], None, self.hourly_capacity, zone_ids=self.zone_ids[dirty],
+                                index=self.index, slot_hours=self.slot_hours)
+        for field, values in zip(RESULT_FIELDS, fresh):
+            self._results[field][dirty] = values
+        self._dirty[:] = False
+
+    # Results of every company, rescoring only the invalidated ones
+    @timed("incremental_score")
+    def results(self):
+        self._refresh()
+        return ScoreResult(*(self._results[field].copy() for field in RESULT_FIELDS))
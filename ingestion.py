@@ -0,0 +1,167 @@
+import csv
+import io
+from collections import namedtuple
+
+import numpy as np
+
+from instrumentation import timed
+from resampling import slots_per_day
+
+# Charging data ingestion for large fleet exports.
+# Accepts CSV or Parquet, either wide ('Hour' plus one 'Company X (kW)' column per company, one
+# row per hour, optionally over several days) or long ('Company', 'Hour', 'Charging (kW)' and
+# optional 'Date' and 'Zone' columns, one row per company and slot; 'Hour' then counts the
+# slot_minutes slots of the day from 0, and with a Zone column each company and zone pair is a
+# site with its own charging row). The schema is checked from the
+# header alone, the data is read in chunks with float32 dtypes (through pyarrow's streaming readers
+# when installed, pandas' C parser otherwise) and returned as the companies x hours charging matrix.
+
+CHARGING_SUFFIX = "(kW)"
+LONG_VALUE_COLUMN = "Charging (kW)"
+CHUNK_ROWS = 1 << 16
+DTYPE = np.float32
+SITE_SEPARATOR = "\x1f"
+
+# One charging row per company, or per site when the data has a Zone column: zones then holds each
+# row's zone and the same company can appear in several rows
+ChargingData = namedtuple("ChargingData", ["companies", "charging", "zones"], defaults=[None])
+
+SCHEMA_ERROR = ("Charging data must contain an 'Hour' column and one 'Company X (kW)' column per company, "
+                "or 'Company', 'Hour' and 'Charging (kW)' columns (optionally 'Date' and 'Zone').")
+
+
+def _company_name(column):
+    return column[:-len(CHARGING_SUFFIX)].strip()
+
+
+def _detect_format(name):
+    return "parquet" if str(name).lower().endswith((".parquet", ".pq")) else "csv"
+
+
+def _as_source(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    return source
+
+
+def _has_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+# Column names of the file, read from the header only
+def read_header(source, fmt):
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        return list(pq.ParquetFile(source).schema_arrow.names)
+    if isinstance(source, str) or hasattr(source, "__fspath__"):
+        with open(source, newline="") as f:
+            return next(csv.reader(f), [])
+    position = source.tell()
+    text = io.TextIOWrapper(source, encoding="utf-8", newline="")
+    header = next(csv.reader(text), [])
+    text.detach()  # keep the underlying file open
+    source.seek(position)
+    return header
+
+
+# Arrow string columns are dictionary encoded first: the lookup is cheap for company names, which
+# repeat a lot, and it avoids pyarrow's pandas-based conversion of strings to numpy
+def _arrow_to_numpy(column):
+    import pyarrow as pa
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        encoded = column.dictionary_encode()
+        dictionary = np.array(encoded.dictionary.to_pylist(), dtype=object)
+        return dictionary[_arrow_values(encoded.indices)]
+    return _arrow_values(column)
+
+
+def _arrow_values(column):
+    import pyarrow as pa
+    zero_copy = column.null_count == 0 and (pa.types.is_integer(column.type) or pa.types.is_floating(column.type))
+    return column.to_numpy(zero_copy_only=zero_copy)
+
+
+# Yield {column: numpy array} chunks of the requested columns; dtypes maps columns to numpy dtypes
+def iter_chunks(source, fmt, columns, dtypes, chunk_rows=CHUNK_ROWS):
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunk_rows, columns=columns):
+            yield {column: _arrow_to_numpy(batch.column(column)) for column in columns}
+    elif _has_pyarrow():
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+        column_types = {column: pa.from_numpy_dtype(dtype) for column, dtype in dtypes.items()
+                        if dtype is not object}
+        reader = pa_csv.open_csv(source, convert_options=pa_csv.ConvertOptions(
+            include_columns=columns, column_types=column_types))
+        for batch in reader:
+            yield {column: _arrow_to_numpy(batch.column(column)) for column in columns}
+    else:
+        import pandas as pd
+        for chunk in pd.read_csv(source, usecols=columns, dtype=dtypes, engine="c", chunksize=chunk_rows):
+            yield {column: chunk[column].to_numpy() for column in columns}
+
+
+def _load_wide(source, fmt, header, chunk_rows):
+    columns = [column for column in header if column.endswith(CHARGING_SUFFIX)]
+    blocks = [np.column_stack([chunk[column] for column in columns]).astype(DTYPE, copy=False)
+              for chunk in iter_chunks(source, fmt, columns, dict.fromkeys(columns, DTYPE), chunk_rows)]
+    charging = np.concatenate(blocks) if blocks else np.zeros((0, len(columns)), dtype=DTYPE)
+    return ChargingData([_company_name(column) for column in columns], np.ascontiguousarray(charging.T))
+
+
+def _load_long(source, fmt, header, chunk_rows, slot_minutes):
+    day_slots = slots_per_day(slot_minutes)
+    optional = [column for column in ("Date", "Zone") if column in header]
+    columns = ["Company", "Hour", LONG_VALUE_COLUMN] + optional
+    dtypes = {"Company": object, "Hour": np.int32, LONG_VALUE_COLUMN: DTYPE}
+    dtypes.update({column: object for column in optional})
+    company_ids = {}  # company name, or (company, zone) site key, -> row
+    codes, slots, values = [], [], []
+    for chunk in iter_chunks(source, fmt, columns, dtypes, chunk_rows):
+        keys = chunk["Company"].astype(str)
+        if "Zone" in chunk:
+            keys = np.char.add(np.char.add(keys, SITE_SEPARATOR), chunk["Zone"].astype(str))
+        names, inverse = np.unique(keys, return_inverse=True)
+        ids = np.array([company_ids.setdefault(name, len(company_ids)) for name in names], dtype=np.int64)
+        codes.append(ids[inverse])
+        slot = chunk["Hour"].astype(np.int64)
+        if len(slot) and (slot.min() < 0 or slot.max() >= day_slots):
+            raise ValueError(f"'Hour' must number the {day_slots} {slot_minutes}-minute slots of a day from 0, "
+                             f"got {slot.min()} to {slot.max()}.")
+        if "Date" in chunk:
+            days = chunk["Date"].astype("datetime64[D]").astype(np.int64)
+            slot = slot + days * day_slots
+        slots.append(slot)
+        values.append(chunk[LONG_VALUE_COLUMN].astype(DTYPE, copy=False))
+    if len(codes) == 0:
+        return ChargingData([], np.zeros((0, 0), dtype=DTYPE), [] if "Zone" in columns else None)
+    codes, slots, values = np.concatenate(codes), np.concatenate(slots), np.concatenate(values)
+    n_slots = day_slots
+    if "Date" in columns:
+        slots -= (slots.min() // day_slots) * day_slots  # first day starts at column 0
+        n_slots *= int(slots.max()) // day_slots + 1  # whole days, whatever slots hold data
+    flat = np.bincount(codes * n_slots + slots, weights=values, minlength=len(company_ids) * n_slots)
+    charging = flat.reshape(len(company_ids), n_slots).astype(DTYPE)
+    if "Zone" in columns:
+        companies, zones = zip(*(key.split(SITE_SEPARATOR) for key in company_ids))
+        return ChargingData(list(companies), charging, list(zones))
+    return ChargingData(list(company_ids), charging)
+
+
+# Load charging data from a path, file-like object or raw bytes; name (a file name) selects
+# CSV or Parquet when source is not a path. slot_minutes is the resolution of long data's 'Hour' slots.
+@timed("ingest")
+def load_charging(source, name=None, chunk_rows=CHUNK_ROWS, slot_minutes=60):
+    fmt = _detect_format(name if name is not None else source)
+    source = _as_source(source)
+    header = read_header(source, fmt)
+    if "Company" in header and "Hour" in header and LONG_VALUE_COLUMN in header:
+        return _load_long(source, fmt, header, chunk_rows, slot_minutes)
+    if "Hour" in header and any(column.endswith(CHARGING_SUFFIX) for column in header):
+        return _load_wide(source, fmt, header, chunk_rows)
+    raise ValueError(SCHEMA_ERROR)
@@ -0,0 +1,94 @@
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Per-stage instrumentation of the analysis pipeline.
+# A process-wide registry records the wall time and call count of every named stage (API request,
+# JSON parsing, table building, chart rendering, scoring, ...) and the lookups and hits of every
+# cache, and exports them as JSON or as Prometheus text exposition format.
+
+METRIC_PREFIX = "carbon_score"
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}  # name -> [calls, total seconds, max seconds]
+            self.caches = {}  # name -> [lookups, hits]
+
+    # Time the body of a with block as one call of the stage
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_time(name, time.perf_counter() - start)
+
+    def record_time(self, name, seconds):
+        with self._lock:
+            stats = self.stages.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+    def record_lookup(self, cache, hit):
+        with self._lock:
+            stats = self.caches.setdefault(cache, [0, 0])
+            stats[0] += 1
+            stats[1] += int(hit)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "stages": {name: {"calls": calls, "seconds": seconds, "max_seconds": longest,
+                                  "mean_seconds": seconds / calls}
+                           for name, (calls, seconds, longest) in self.stages.items()},
+                "caches": {name: {"lookups": lookups, "hits": hits, "hit_ratio": hits / lookups}
+                           for name, (lookups, hits) in self.caches.items()},
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+    def to_prometheus(self):
+        snapshot = self.snapshot()
+        series = [
+            ("stage_seconds_total", "counter", "Wall time spent in each pipeline stage.", "stage",
+             {name: stats["seconds"] for name, stats in snapshot["stages"].items()}),
+            ("stage_calls_total", "counter", "Calls of each pipeline stage.", "stage",
+             {name: stats["calls"] for name, stats in snapshot["stages"].items()}),
+            ("stage_max_seconds", "gauge", "Longest single call of each pipeline stage.", "stage",
+             {name: stats["max_seconds"] for name, stats in snapshot["stages"].items()}),
+            ("cache_lookups_total", "counter", "Lookups of each cache.", "cache",
+             {name: stats["lookups"] for name, stats in snapshot["caches"].items()}),
+            ("cache_hits_total", "counter", "Hits of each cache.", "cache",
+             {name: stats["hits"] for name, stats in snapshot["caches"].items()}),
+        ]
+        lines = []
+        for metric, kind, help_text, label, values in series:
+            lines.append(f"# HELP {METRIC_PREFIX}_{metric} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{metric} {kind}")
+            for name, value in sorted(values.items()):
+                lines.append(f'{METRIC_PREFIX}_{metric}{{{label}="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+# Decorator recording every call of the function as one call of the stage
+def timed(name):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with metrics.stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
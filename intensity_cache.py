@@ -0,0 +1,92 @@
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from instrumentation import metrics
+from resampling import HOURS_PER_DAY
+
+# Persistent on-disk cache for the carbon intensity history of a zone on a given day.
+# A past day's history never changes, so once it has been fetched after the day ended it
+# is kept forever; the current day (or a day fetched while it was still running) is only
+# reused for a short time. The number of stored days is bounded, least recently used first.
+
+CACHE_PATH = ".intensity_cache.sqlite"
+TODAY_TTL_SECONDS = 15 * 60
+MAX_ENTRIES = 10000
+
+
+def _day_key(date):
+    return date.strftime('%Y-%m-%d')
+
+
+class IntensityCache:
+    def __init__(self, path=CACHE_PATH, today_ttl=TODAY_TTL_SECONDS, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.today_ttl = today_ttl
+        self.max_entries = max_entries
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS intensities (
+                    zone TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    complete INTEGER NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (zone, day)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS intensities_accessed ON intensities (accessed_at)")
+
+    # A short-lived connection per call keeps the cache usable from Streamlit's script threads
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    # Return the cached intensities for (zone, date), or None when missing or expired
+    def get(self, zone, date):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT payload, complete, fetched_at FROM intensities WHERE zone = ? AND day = ?",
+                (zone, _day_key(date))).fetchone()
+            if row is None:
+                metrics.record_lookup("intensity_cache", hit=False)
+                return None
+            payload, complete, fetched_at = row
+            if not complete and now - fetched_at > self.today_ttl:
+                metrics.record_lookup("intensity_cache", hit=False)
+                return None
+            metrics.record_lookup("intensity_cache", hit=True)
+            conn.execute("UPDATE intensities SET accessed_at = ? WHERE zone = ? AND day = ?",
+                         (now, zone, _day_key(date)))
+        return json.loads(payload)
+
+    # Store the intensities for (zone, date) and evict the least recently used days over the limit
+    def put(self, zone, date, values):
+        if len(values) == 0:
+            return  # never cache a failed or empty response
+        now = time.time()
+        day = _day_key(date)
+        # The history is final only if it was downloaded after the (UTC) day was over and has every hour
+        complete = int(day < _day_key(datetime.utcnow().date()) and len(values) == HOURS_PER_DAY)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO intensities (zone, day, payload, complete, fetched_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (zone, day, json.dumps(list(values)), complete, now, now))
+            conn.execute(
+                "DELETE FROM intensities WHERE rowid IN ("
+                "SELECT rowid FROM intensities ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,))
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM intensities")
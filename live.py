@@ -0,0 +1,114 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from carbon_api import MAX_WORKERS, fetch_intensity_range
+from instrumentation import timed
+from resampling import HOURS_PER_DAY
+from scoring import HOURLY_CAPACITY, IntensityIndex, aggregate_sites, default_zone_ids, score_from_totals
+
+# Live scoring of the current day.
+# LiveDay holds the hours of today's intensity history received so far for each zone and polls the
+# API for the hours after them only, writing the new values into preallocated arrays. Companies
+# are scored on the hours every zone has reached: emissions are running sums advanced by the new
+# hours only, and the best and worst case come from the sorted elapsed hours of each zone.
+
+POLL_SECONDS = 300
+
+
+class LiveDay:
+    # charging is the hourly (companies x 24) profile; for multi-site fleets its rows are sites and
+    # site_companies sums them into n_companies per-company results
+    def __init__(self, zones, day, charging, zone_ids=None, hourly_capacity=HOURLY_CAPACITY,
+                 site_companies=None, n_companies=None):
+        self.zones = list(zones)
+        self.day = day
+        self.charging = np.array(charging, dtype=np.float64, ndmin=2)
+        n_rows = self.charging.shape[0]
+        if zone_ids is None:
+            zone_ids = default_zone_ids(len(self.zones), n_rows)
+        self.zone_ids = np.asarray(zone_ids, dtype=np.intp)
+        self.hourly_capacity = hourly_capacity
+        self.site_companies = site_companies
+        self.n_companies = n_companies
+
+        self.intensities = np.full((len(self.zones), HOURS_PER_DAY), np.nan)
+        self.held = np.zeros(len(self.zones), dtype=np.intp)  # leading hours received per zone
+        self.hours = 0  # hours scored, those held by every zone
+        self.hourly_emissions = np.zeros((n_rows, HOURS_PER_DAY))
+        self.emissions = np.zeros(n_rows)
+        self.energy = np.zeros(n_rows)
+        self.last_poll = None  # monotonic time of the last poll, polled_at its UTC time
+        self.polled_at = None
+        self.failed_zones = []
+
+    @property
+    def complete(self):
+        return int(self.held.min()) == HOURS_PER_DAY
+
+    def _midnight(self):
+        return datetime(self.day.year, self.day.month, self.day.day)
+
+    # Whether at least poll_seconds have passed since the last poll
+    def due(self, poll_seconds=POLL_SECONDS):
+        if self.complete:
+            return False
+        return self.last_poll is None or time.monotonic() - self.last_poll >= poll_seconds
+
+    # Store the values of one zone starting at hour start; only the hour after those held extends
+    # the held hours, so a gap is filled by a later poll instead of being skipped
+    def add(self, zone, values, start=0):
+        z = self.zones.index(zone)
+        for hour, value in enumerate(values, start):
+            if hour == self.held[z] and hour < HOURS_PER_DAY:
+                self.intensities[z, hour] = value
+                self.held[z] += 1
+
+    # Fetch the hours published since the last poll for every zone, returning the number of new
+    # hours received. Zones whose request failed are listed in failed_zones and retried next poll.
+    @timed("live_poll")
+    def poll(self, now=None):
+        midnight = self._midnight()
+        end = min(now or datetime.utcnow(), midnight + timedelta(days=1))
+        pending = [z for z in range(len(self.zones)) if self.held[z] < HOURS_PER_DAY]
+        before = int(self.held.sum())
+
+        def fetch(z):
+            return fetch_intensity_range(self.zones[z], midnight + timedelta(hours=int(self.held[z])), end)
+
+        self.failed_zones = []
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(pending))) as executor:
+                for z, entries in zip(pending, executor.map(fetch, pending)):
+                    if entries is None:
+                        self.failed_zones.append(self.zones[z])
+                        continue
+                    for hour, value in entries:
+                        self.add(self.zones[z], [value], (hour - midnight) // timedelta(hours=1))
+        self.last_poll, self.polled_at = time.monotonic(), datetime.utcnow()
+        return int(self.held.sum()) - before
+
+    def _advance(self):
+        hours = int(self.held.min())
+        if hours <= self.hours:
+            return
+        new = slice(self.hours, hours)
+        self.hourly_emissions[:, new] = self.charging[:, new] * self.intensities[self.zone_ids, new]
+        self.emissions += self.hourly_emissions[:, new].sum(axis=-1)
+        self.energy += self.charging[:, new].sum(axis=-1)
+        self.hours = hours
+
+    # Results over the hours scored so far, or None before every zone has its first hour
+    def results(self):
+        self._advance()
+        if self.hours == 0:
+            return None
+        index = IntensityIndex(self.intensities[:, :self.hours])
+        best_case, worst_case = index.scenarios(self.energy, self.zone_ids, self.hourly_capacity)
+        results = score_from_totals(self.emissions.copy(), self.hourly_emissions[:, :self.hours].copy(),
+                                    best_case, worst_case)
+        if self.site_companies is not None:
+            results = aggregate_sites(results, self.site_companies, self.n_companies)
+        return results
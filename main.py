@@ -1,9 +1,17 @@
 import streamlit as st
 import numpy as np
 import pandas as pd
-import requests
-import matplotlib.pyplot as plt
-from datetime import datetime
+from datetime import datetime, timedelta
+from app_cache import (build_intensity_table, capacity_sweep_png, default_charging_values, fetch_zone_intensities,
+                       history_store, intensity_cache, load_charging_upload, ranking_rows,
+                       score_fleet, score_fleet_sites, score_uncertainty, show_live_ranking,
+                       show_metrics_panel, site_intensities, sweep_capacities, zone_chart_png,
+                       zone_facets_png)
+from instrumentation import metrics
+from pipeline import RangeAggregate, iter_days, stream_scores
+from resampling import resample, slots_per_day
+from scheduler import optimal_schedule
+from scoring import encode_sites
 
 # CSS to customize the Streamlit style
 st.markdown("""
@@ -30,59 +38,6 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
-# Function to fetch carbon intensities for a specific zone on the selected day
-def fetch_carbon_intensities(zone, date):
-    url = "https://api.electricitymap.org/v3/carbon-intensity/history"
-    params = {"zone": zone, "date": date.strftime('%Y-%m-%d')}
-    headers = {"auth-token": "YOUR_API_TOKEN"}
-    response = requests.get(url, params=params, headers=headers)
-    if response.status_code == 200:
-        data = response.json()
-        return [entry["carbonIntensity"] for entry in data["history"]]
-    else:
-        st.error(f"Failed to fetch carbon intensities for {zone} on {date}.")
-        return []
-
-
-# Function to calculate total daily emissions
-def calculate_daily_emissions(charging, emissions):
-    hourly_emissions = charging * emissions
-    daily_emissions = np.sum(hourly_emissions)
-    return daily_emissions, hourly_emissions
-
-# Function to calculate emission scenarios
-def calculate_scenarios(total_charging, emissions):
-    emissions_sorted_asc = np.sort(emissions)
-    emissions_sorted_desc = np.sort(emissions)[::-1]
-
-    hourly_capacity = 10  # Define hourly capacity as 10
-    hours_needed = int(np.ceil(total_charging / hourly_capacity))
-
-    best_case_total = np.sum(hourly_capacity * emissions_sorted_asc[:hours_needed])
-    worst_case_total = np.sum(hourly_capacity * emissions_sorted_desc[:hours_needed])
-
-    return best_case_total, worst_case_total
-
-# Calculate the score using the new approach
-def calculate_score(actual_emissions, best_case, worst_case):
-    if worst_case == best_case:
-        return 0  # or any other value that makes sense for your application
-    return (actual_emissions - best_case) / (worst_case - best_case)
-
-# Calculate detailed percentages
-def calculate_percentages(actual_emissions, best_case, worst_case):
-    away_best = ((actual_emissions - best_case) / best_case) * 100
-    away_worst = ((worst_case - actual_emissions) / worst_case) * 100
-    return away_best, away_worst
-
-# Default example of charging values (randomly generated)
-default_charging_values = {
-    'Hour': list(range(24)),
-    'Company 1 (kW)': np.random.randint(0, 13, 24),  # valores entre 0 e 12
-    'Company 2 (kW)': np.random.randint(0, 13, 24),  # valores entre 0 e 12
-    'Company 3 (kW)': np.random.randint(0, 13, 24)   # valores entre 0 e 12
-}
-
 # Function to style score with arrows
 def style_score(value):
     if value > 0:
@@ -141,85 +96,90 @@ zones = st.multiselect("Select up to 3 countries", ["DE", "IT", "PT", "FR", "ES"
 if len(zones) > 3:
     st.error("Please select only up to 3 countries.")
 
-intensities = {}
-for zone in zones:
-    intensities[zone] = fetch_carbon_intensities(zone, date)
+intensities = fetch_zone_intensities(zones, date)
 
 # Display the table of carbon intensities with units
-df_intensities = pd.DataFrame(intensities).T
-df_intensities.index.name = 'Zone'
-df_intensities.columns.name = 'Hour'
-df_intensities = df_intensities.rename(columns={h: f'{h}: gCO2/kWh' for h in df_intensities.columns})
+df_intensities = build_intensity_table(intensities)
 st.dataframe(df_intensities)
 
 
 # Display bar charts below the table
-for zone in zones:
-    st.subheader(f"Carbon Intensity for {zone}")
-    fig, ax = plt.subplots(figsize=(10, 5))
-    ax.bar(range(24), intensities[zone], color='blue')
-    ax.set_title(f"Carbon Intensity for {zone}")
-    ax.set_xlabel("Hour")
-    ax.set_ylabel("Carbon Intensity (gCO2/kWh)")
-    st.pyplot(fig)
+if st.checkbox("Show all zones in one chart"):
+    st.image(zone_facets_png(date, intensities))
+else:
+    for zone in zones:
+        st.subheader(f"Carbon Intensity for {zone}")
+        st.image(zone_chart_png(zone, date, intensities[zone]))
 
 # User input for charging values
 st.subheader("Charging Values for Each Company")
 
-# Option to upload a CSV file
-uploaded_file = st.file_uploader("Upload a CSV file", type="csv")
+# Option to upload a CSV or Parquet file
+uploaded_file = st.file_uploader("Upload a CSV or Parquet file", type=["csv", "parquet"])
 
 # Add an information button about CSV rules
 if st.button("📄 CSV Info"):
     st.markdown("""
         <div style="background-color: #f0f0f0; padding: 10px; border-radius: 5px;">
-            The CSV file must contain the following columns: 'Hour', 'Company 1', 'Company 2', and 'Company 3'. <br>
-            Each column must contain 24 values representing the hours of the day, with 'Company X' values in kW (kilowatts).
+            The file must contain an 'Hour' column and one 'Company X (kW)' column per company, e.g. 'Company 1 (kW)', 'Company 2 (kW)', ... <br>
+            Each row holds one hour of the day, with 'Company X' values in kW (kilowatts). <br>
+            Long files with 'Company', 'Hour' and 'Charging (kW)' columns (and optionally 'Date') are accepted too. <br>
+            Companies charging in several countries add a 'Zone' column with one row per site, e.g. 'DE' or 'FR'.
         </div>
     """, unsafe_allow_html=True)
 
+# Charging data is hourly unless the uploaded file is logged at a finer resolution
+resolution = 60
+site_zones = None
 if uploaded_file is not None:
-    df = pd.read_csv(uploaded_file)
-    if 'Hour' in df.columns and 'Company 1 (kW)' in df.columns and 'Company 2 (kW)' in df.columns and 'Company 3 (kW)' in df.columns:
-        charging_company_1 = df['Company 1 (kW)'].values
-        charging_company_2 = df['Company 2 (kW)'].values
-        charging_company_3 = df['Company 3 (kW)'].values
-    else:
-        st.error("CSV file must contain 'Hour', 'Company 1', 'Company 2', and 'Company 3' columns.")
+    resolution = st.selectbox("Charging data resolution (minutes per row)", [60, 30, 15, 10, 5, 1])
+    try:
+        companies, charging, site_zones = load_charging_upload(uploaded_file.getvalue(), uploaded_file.name,
+                                                                 resolution)
+    except ValueError as error:
+        st.error(str(error))
+        st.stop()
+    if charging.shape[1] > slots_per_day(resolution):
+        st.info("The file holds more than one day of charging data; the analysis uses its first day.")
+        charging = charging[:, :slots_per_day(resolution)]
+    elif charging.shape[1] < slots_per_day(resolution):
+        st.error(f"The file must hold {slots_per_day(resolution)} rows per day at {resolution}-minute resolution.")
+        st.stop()
 else:
     # Use default values if no file is uploaded
-    st.write("Using default values for the companies:")
-    st.dataframe(pd.DataFrame(default_charging_values))
-    charging_company_1 = np.array(default_charging_values['Company 1 (kW)'])
-    charging_company_2 = np.array(default_charging_values['Company 2 (kW)'])
-    charging_company_3 = np.array(default_charging_values['Company 3 (kW)'])
-
-total_charging_company_1 = np.sum(charging_company_1)
-total_charging_company_2 = np.sum(charging_company_2)
-total_charging_company_3 = np.sum(charging_company_3)
-
-emissions_company_1, hourly_emissions_company_1 = calculate_daily_emissions(charging_company_1, intensities["DE"])
-emissions_company_2, hourly_emissions_company_2 = calculate_daily_emissions(charging_company_2, intensities["IT"])
-emissions_company_3, hourly_emissions_company_3 = calculate_daily_emissions(charging_company_3, intensities["PT"])
-
-best_case_1, worst_case_1 = calculate_scenarios(total_charging_company_1, intensities["DE"])
-best_case_2, worst_case_2 = calculate_scenarios(total_charging_company_2, intensities["IT"])
-best_case_3, worst_case_3 = calculate_scenarios(total_charging_company_3, intensities["PT"])
-
-score_1 = calculate_score(emissions_company_1, best_case_1, worst_case_1)
-score_2 = calculate_score(emissions_company_2, best_case_2, worst_case_2)
-score_3 = calculate_score(emissions_company_3, best_case_3, worst_case_3)
-
-percent_away_best_1, percent_away_worst_1 = calculate_percentages(emissions_company_1, best_case_1, worst_case_1)
-percent_away_best_2, percent_away_worst_2 = calculate_percentages(emissions_company_2, best_case_2, worst_case_2)
-percent_away_best_3, percent_away_worst_3 = calculate_percentages(emissions_company_3, best_case_3, worst_case_3)
-
-companies = ['Company 1', 'Company 2', 'Company 3']
-scores = [score_1, score_2, score_3]
-percent_away_best = [percent_away_best_1, percent_away_best_2, percent_away_best_3]
-percent_away_worst = [percent_away_worst_1, percent_away_worst_2, percent_away_worst_3]
-
-df_ranking = pd.DataFrame(list(zip(companies, scores, percent_away_best, percent_away_worst)), columns=["Company", "Score", "% away from Best Scenario", "% away from Worst Scenario"])
+    st.write("Using default values for the companies (edit a cell to rescore that company):")
+    default_values = st.data_editor(pd.DataFrame(default_charging_values()), disabled=["Hour"])
+    companies = ['Company 1', 'Company 2', 'Company 3']
+    charging = np.vstack([default_values[f'{company} (kW)'] for company in companies])
+
+if site_zones is not None:
+    # Multi-site fleet: every site charges in the zone given in the file and the results of a
+    # company's sites are summed
+    site_labels = [f"{company} ({zone})" for company, zone in zip(companies, site_zones)]
+    companies, company_zones, site_companies, zone_ids = encode_sites(companies, site_zones)
+    zone_intensities = site_intensities(company_zones, date, resolution)
+    results = score_fleet_sites(charging, zone_intensities, site_companies, zone_ids, len(companies),
+                                slot_hours=resolution / 60)
+else:
+    # Score all companies in one batched pass, company i charging in the i-th selected zone
+    # (companies beyond the number of selected zones cycle through them)
+    if not zones:
+        st.info("Select at least one country to score the companies.")
+        st.stop()
+    site_labels, site_companies = companies, None
+    company_zones = list(zones)
+    zone_ids = np.arange(len(companies)) % len(company_zones)
+    zone_intensities = site_intensities(company_zones, date, resolution)
+    results = score_fleet(charging, zone_intensities, zone_ids=zone_ids, slot_hours=resolution / 60)
+
+# Only the ranking rows on screen are built and formatted
+st.subheader("Overall Company Ranking")
+rows, ranks = ranking_rows(results.score)
+df_ranking = pd.DataFrame(
+    list(zip([companies[i] for i in rows], results.score[rows], results.percent_away_best[rows],
+             results.percent_away_worst[rows])),
+    columns=["Company", "Score", "% away from Best Scenario", "% away from Worst Scenario"],
+    index=pd.Index(ranks, name="Rank"))
 
 # Apply conditional styles with arrows
 def style_percentages(value, scenario):
@@ -232,12 +192,12 @@ df_ranking["% away from Best Scenario"] = df_ranking.apply(lambda row: style_per
 df_ranking["% away from Worst Scenario"] = df_ranking.apply(lambda row: style_percentages(row["% away from Worst Scenario"], "worst"), axis=1)
 
 # Display ranking table
-st.subheader("Overall Company Ranking")
-st.dataframe(df_ranking.style.applymap(lambda x: 'color: red' if isinstance(x, str) and x.startswith('🔺') else ('color: green' if isinstance(x, str) and x.startswith('🔻') else '')).set_table_styles([{
-    'selector': 'td',
-    'props': [
-        ('max-width', '200px'), ('font-size', '12px')]
-}]))
+with metrics.stage("ranking_table"):
+    st.dataframe(df_ranking.style.applymap(lambda x: 'color: red' if isinstance(x, str) and x.startswith('🔺') else ('color: green' if isinstance(x, str) and x.startswith('🔻') else '')).set_table_styles([{
+        'selector': 'td',
+        'props': [
+            ('max-width', '200px'), ('font-size', '12px')]
+    }]))
 
 st.markdown(
     """
@@ -252,3 +212,81 @@ st.markdown(
     """,
     unsafe_allow_html=True
 )
+
+# Carbon-optimal plan: each company's (or site's) daily energy moved to the cleanest slots of its zone
+st.subheader("Carbon-Optimal Charging Plan")
+schedule = optimal_schedule(charging.sum(axis=1) * resolution / 60, zone_intensities, zone_ids=zone_ids,
+                            slot_hours=resolution / 60)
+slot_starts = range(0, 24 * 60, resolution)
+df_plan = pd.DataFrame(schedule.plan, index=site_labels,
+                       columns=[f'{m // 60:02d}:{m % 60:02d}: kW' for m in slot_starts])
+df_plan.index.name = 'Company'
+st.dataframe(df_plan)
+st.download_button("Download charging plan (CSV)", df_plan.to_csv(), file_name=f"charging_plan_{date}.csv",
+                   mime="text/csv")
+
+# Monte Carlo uncertainty: how far scores and ranks move when charging and intensities are perturbed
+st.subheader("Uncertainty Analysis")
+if st.checkbox("Run a Monte Carlo uncertainty analysis"):
+    col_draws, col_noise, col_seed = st.columns(3)
+    draws = col_draws.number_input("Draws", 100, 100000, 1000, step=100)
+    noise = col_noise.slider("Perturbation (% standard deviation)", 0, 50, 10)
+    seed = col_seed.number_input("Seed", 0, value=0)
+    mc = score_uncertainty(charging, zone_intensities, zone_ids, draws, noise / 100, seed,
+                           slot_hours=resolution / 60, site_companies=site_companies, n_companies=len(companies))
+    rows, ranks = ranking_rows(mc.score_mean, key="uncertainty")
+    st.dataframe(pd.DataFrame({
+        "Company": [companies[i] for i in rows],
+        "Mean Score": mc.score_mean[rows],
+        "Score 95% CI": [f"{low:.3f} – {high:.3f}" for low, high in zip(mc.score_low[rows], mc.score_high[rows])],
+        "Median Rank": mc.rank_median[rows],
+        "Rank 95% CI": [f"{low} – {high}" for low, high in zip(mc.rank_low[rows], mc.rank_high[rows])],
+    }, index=pd.Index(ranks, name="Rank")))
+
+# Capacity sweep: how each score moves as the hourly charging capacity of the depots changes
+st.subheader("Capacity Sensitivity")
+if st.checkbox("Sweep the hourly charging capacity"):
+    col_range, col_points = st.columns([3, 1])
+    low, high = col_range.slider("Hourly capacity (kW)", 1, 500, (3, 350))
+    points = col_points.number_input("Grid points", 2, 200, 50)
+    sweep = sweep_capacities(charging, zone_intensities, zone_ids, np.geomspace(low, high, points),
+                             slot_hours=resolution / 60, site_companies=site_companies, n_companies=len(companies))
+    chosen = st.multiselect("Companies to plot", range(len(companies)), default=list(range(min(len(companies), 5))),
+                            format_func=lambda i: companies[i])
+    st.image(capacity_sweep_png(sweep.capacities, sweep.score, companies, chosen))
+    df_sweep = pd.DataFrame(sweep.score.T, index=pd.Index(companies, name="Company"),
+                            columns=[f"{capacity:.1f} kW" for capacity in sweep.capacities])
+    st.dataframe(df_sweep.iloc[chosen])
+    st.download_button("Download capacity sweep (CSV)", df_sweep.to_csv(), file_name=f"capacity_sweep_{date}.csv",
+                       mime="text/csv")
+
+# Live mode: today's ranking so far, refreshed in place as new hours are published
+st.subheader("Live Mode")
+if st.checkbox("Follow today's carbon intensities live"):
+    poll_minutes = st.number_input("Poll interval (minutes)", 1, 60, 5)
+    show_live_ranking(companies, resample(charging, resolution, 60), company_zones, zone_ids,
+                      site_companies=site_companies, poll_seconds=poll_minutes * 60)
+
+# Date range analysis: days are fetched and scored as a stream and the table updates as they arrive
+st.subheader("Date Range Analysis")
+if st.checkbox("Analyse a date range"):
+    date_range = st.date_input("Select the date range for analysis", (date - timedelta(days=6), date))
+    if len(date_range) == 2:
+        start_date, end_date = date_range
+        progress = st.progress(0.0)
+        range_table = st.empty()
+        n_days = (end_date - start_date).days + 1
+        aggregate = RangeAggregate(len(companies))
+        for day, day_results in stream_scores(charging, company_zones, iter_days(start_date, end_date),
+                                              zone_ids=zone_ids, cache=intensity_cache, slot_minutes=resolution,
+                                              site_companies=site_companies, n_companies=len(companies),
+                                              store=history_store):
+            aggregate.add(day, day_results)
+            progress.progress((aggregate.days + len(aggregate.skipped_days)) / n_days)
+            df_range = pd.DataFrame(aggregate.summary())
+            df_range.insert(0, "Company", companies)
+            range_table.dataframe(df_range)
+        if len(aggregate.skipped_days) > 0:
+            st.warning(f"No complete carbon intensity data for {len(aggregate.skipped_days)} day(s); they were skipped.")
+
+show_metrics_panel()
@@ -1,9 +1,13 @@
 import streamlit as st
 import numpy as np
 import pandas as pd
-import requests
-import matplotlib.pyplot as plt
 from datetime import datetime
+from app_cache import (build_intensity_table, default_charging_values, fetch_zone_intensities,
+                       load_charging_upload, ranking_rows, score_fleet, score_fleet_sites,
+                       show_metrics_panel, site_intensities, zone_chart_png, zone_facets_png)
+from instrumentation import metrics
+from resampling import slots_per_day
+from scoring import encode_sites
 
 # CSS to customize the Streamlit style
 st.markdown("""
@@ -30,58 +34,6 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
-# Function to fetch carbon intensities for a specific zone on the selected day
-def fetch_carbon_intensities(zone, date):
-    url = "https://api.electricitymap.org/v3/carbon-intensity/history"
-    params = {"zone": zone, "date": date.strftime('%Y-%m-%d')}
-    headers = {"auth-token": "YOUR_API_TOKEN"}  # Replace with your API token
-    response = requests.get(url, params=params, headers=headers)
-    if response.status_code == 200:
-        data = response.json()
-        return [entry["carbonIntensity"] for entry in data["history"]]
-    else:
-        st.error(f"Failed to fetch carbon intensities for {zone} on {date}.")
-        return []
-
-# Function to calculate total daily emissions
-def calculate_daily_emissions(charging, emissions):
-    hourly_emissions = charging * emissions
-    daily_emissions = np.sum(hourly_emissions)
-    return daily_emissions, hourly_emissions
-
-# Function to calculate emission scenarios
-def calculate_scenarios(total_charging, emissions):
-    emissions_sorted_asc = np.sort(emissions)
-    emissions_sorted_desc = np.sort(emissions)[::-1]
-
-    hourly_capacity = 10  # Define hourly capacity as 10
-    hours_needed = int(np.ceil(total_charging / hourly_capacity))
-
-    best_case_total = np.sum(hourly_capacity * emissions_sorted_asc[:hours_needed])
-    worst_case_total = np.sum(hourly_capacity * emissions_sorted_desc[:hours_needed])
-
-    return best_case_total, worst_case_total
-
-# Calculate the score using the new approach
-def calculate_score(actual_emissions, best_case, worst_case):
-    if worst_case == best_case:
-        return 0  # or any other value that makes sense for your application
-    return (actual_emissions - best_case) / (worst_case - best_case)
-
-# Calculate detailed percentages
-def calculate_percentages(actual_emissions, best_case, worst_case):
-    away_best = ((actual_emissions - best_case) / best_case) * 100
-    away_worst = ((worst_case - actual_emissions) / worst_case) * 100
-    return away_best, away_worst
-
-# Default example of charging values (randomly generated)
-default_charging_values = {
-    'Hour': list(range(24)),
-    'Company 1 (kW)': np.random.randint(0, 13, 24),  # valores entre 0 e 12
-    'Company 2 (kW)': np.random.randint(0, 13, 24),  # valores entre 0 e 12
-    'Company 3 (kW)': np.random.randint(0, 13, 24)   # valores entre 0 e 12
-}
-
 # Function to style score with arrows
 def style_score(value):
     if value > 0:
@@ -140,99 +92,86 @@ zones = st.multiselect("Select up to 3 countries", ["DE", "IT", "PT", "FR", "ES"
 if len(zones) > 3:
     st.error("Please select only up to 3 countries.")
 
-intensities = {}
-for zone in zones:
-    intensities[zone] = fetch_carbon_intensities(zone, date)
+intensities = fetch_zone_intensities(zones, date)
 
 # Display the table of carbon intensities with units
-df_intensities = pd.DataFrame(intensities).T
-df_intensities.index.name = 'Zone'
-df_intensities.columns.name = 'Hour'
-df_intensities = df_intensities.rename(columns={h: f'{h}: gCO2/kWh' for h in df_intensities.columns})
+df_intensities = build_intensity_table(intensities)
 st.dataframe(df_intensities)
 
 # Display bar charts below the table
-for zone in zones:
-    st.subheader(f"Carbon Intensity for {zone}")
-    fig, ax = plt.subplots(figsize=(10, 5))
-    ax.bar(range(24), intensities[zone], color='blue')
-    ax.set_title(f"Carbon Intensity for {zone}")
-    ax.set_xlabel("Hour")
-    ax.set_ylabel("Carbon Intensity (gCO2/kWh)")
-    st.pyplot(fig)
+if st.checkbox("Show all zones in one chart"):
+    st.image(zone_facets_png(date, intensities))
+else:
+    for zone in zones:
+        st.subheader(f"Carbon Intensity for {zone}")
+        st.image(zone_chart_png(zone, date, intensities[zone]))
 
 # User input for charging values
 st.subheader("Charging Values for Each Company")
 
-# Option to upload a CSV file
-uploaded_file = st.file_uploader("Upload a CSV file", type="csv")
+# Option to upload a CSV or Parquet file
+uploaded_file = st.file_uploader("Upload a CSV or Parquet file", type=["csv", "parquet"])
 
 # Add an information button about CSV rules
 if st.button("📄 CSV Info"):
     st.markdown("""
         <div style="background-color: #f0f0f0; padding: 10px; border-radius: 5px;">
-            The CSV file must contain the following columns: 'Hour', 'Company 1', 'Company 2', and 'Company 3'. <br>
-            Each column must contain 24 values representing the hours of the day, with 'Company X' values in kW (kilowatts).
+            The file must contain an 'Hour' column and one 'Company X (kW)' column per company, e.g. 'Company 1 (kW)', 'Company 2 (kW)', ... <br>
+            Each row holds one hour of the day, with 'Company X' values in kW (kilowatts). <br>
+            Long files with 'Company', 'Hour' and 'Charging (kW)' columns (and optionally 'Date') are accepted too. <br>
+            Companies charging in several countries add a 'Zone' column with one row per site, e.g. 'DE' or 'FR'.
         </div>
     """, unsafe_allow_html=True)
 
 if uploaded_file is not None:
-    df = pd.read_csv(uploaded_file)
-    if 'Hour' in df.columns and 'Company 1 (kW)' in df.columns and 'Company 2 (kW)' in df.columns and 'Company 3 (kW)' in df.columns:
-        charging_company_1 = df['Company 1 (kW)'].values
-        charging_company_2 = df['Company 2 (kW)'].values
-        charging_company_3 = df['Company 3 (kW)'].values
-    else:
-        st.error("CSV file must contain 'Hour', 'Company 1', 'Company 2', and 'Company 3' columns.")
+    try:
+        companies, charging, site_zones = load_charging_upload(uploaded_file.getvalue(), uploaded_file.name)
+    except ValueError as error:
+        st.error(str(error))
+        st.stop()
+    # This page scores hourly charging data; a finer resolution would not fill whole days of 24 rows
+    if charging.shape[1] < slots_per_day(60) or charging.shape[1] % slots_per_day(60):
+        st.error(f"The file must hold {slots_per_day(60)} rows per day of hourly charging data.")
+        st.stop()
+    if charging.shape[1] > slots_per_day(60):
+        st.info("The file holds more than one day of charging data; the analysis uses its first day.")
+        charging = charging[:, :slots_per_day(60)]
 else:
     # Use default values if no file is uploaded
     st.write("Using default values for the companies:")
-    st.dataframe(pd.DataFrame(default_charging_values))
-    charging_company_1 = np.array(default_charging_values['Company 1 (kW)'])
-    charging_company_2 = np.array(default_charging_values['Company 2 (kW)'])
-    charging_company_3 = np.array(default_charging_values['Company 3 (kW)'])
-
-# Agora, você pode calcular as emissões para cada país selecionado
-emissions = []
-hourly_emissions = []
-for i, zone in enumerate(zones):
-    if zone in intensities:
-        charging_values = [charging_company_1, charging_company_2, charging_company_3][i]
-        emissions_company, hourly_emissions_company = calculate_daily_emissions(
-            charging_values, intensities[zone])
-        emissions.append(emissions_company)
-        hourly_emissions.append(hourly_emissions_company)
-    else:
-        st.error(f"Nenhum dado disponível para a zona {zone}.")
-
-# Cálculo dos cenários para cada empresa
-best_cases = []
-worst_cases = []
-for i, zone in enumerate(zones):
-    if zone in intensities:
-        total_charging = np.sum([charging_company_1, charging_company_2, charging_company_3][i])
-        best_case, worst_case = calculate_scenarios(total_charging, intensities[zone])
-        best_cases.append(best_case)
-        worst_cases.append(worst_case)
-
-# Cálculo dos scores
-scores = []
-for i in range(len(emissions)):
-    score = calculate_score(emissions[i], best_cases[i], worst_cases[i])
-    scores.append(score)
-
-# Criação da tabela de ranking
-companies = ['Company 1', 'Company 2', 'Company 3']
-df_ranking = pd.DataFrame({
-    "Company": companies,
-    "Score": scores,
-    "% away from Best Scenario": [(calculate_percentages(emissions[i], best_cases[i], worst_cases[i])[0]) for i in range(len(emissions))],
-    "% away from Worst Scenario": [(calculate_percentages(emissions[i], best_cases[i], worst_cases[i])[1]) for i in range(len(emissions))]
-})
+    default_values = default_charging_values()
+    st.dataframe(pd.DataFrame(default_values))
+    companies = ['Company 1', 'Company 2', 'Company 3']
+    charging = np.vstack([default_values[f'{company} (kW)'] for company in companies])
+    site_zones = None
+
+if site_zones is not None:
+    # Multi-site fleet: every site charges in the zone given in the file and the results of a
+    # company's sites are summed
+    companies, site_zone_names, site_companies, zone_ids = encode_sites(companies, site_zones)
+    results = score_fleet_sites(charging, site_intensities(site_zone_names, date), site_companies, zone_ids,
+                                len(companies))
+else:
+    # Score the companies in one batched pass, company i charging in the i-th selected zone
+    # (companies beyond the number of selected zones cycle through them)
+    zone_ids = np.arange(len(companies)) % len(zones)
+    results = score_fleet(charging, np.array([intensities[zone] for zone in zones]), zone_ids=zone_ids)
 
 # Exibição da tabela de ranking
 st.subheader("Overall Company Ranking")
 
+# Criação da tabela de ranking, só com as linhas visíveis
+rows, ranks = ranking_rows(results.score)
+df_ranking = pd.DataFrame({
+    "Company": [companies[i] for i in rows],
+    "Score": results.score[rows],
+    "% away from Best Scenario": results.percent_away_best[rows],
+    "% away from Worst Scenario": results.percent_away_worst[rows]
+}, index=pd.Index(ranks, name="Rank"))
+
 # Style scores with arrows
 df_ranking['Score'] = df_ranking['Score'].apply(style_score)
-st.dataframe(df_ranking)
+with metrics.stage("ranking_table"):
+    st.dataframe(df_ranking)
+
+show_metrics_panel()
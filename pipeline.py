@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from carbon_api import fetch_many
+from resampling import HOURS_PER_DAY, resample
+from scoring import HOURLY_CAPACITY, IntensityIndex, aggregate_sites, score_companies
+
+# Streaming date-range analysis.
+# Days flow through fetch -> align -> score as generators, a chunk of days being fetched
+# concurrently at a time, and results are folded into a RangeAggregate as they arrive, so
+# memory does not grow with the length of the range and the first days show up immediately.
+
+CHUNK_DAYS = 7
+
+
+# Date of a YYYY-MM-DD command-line argument
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+# Every date from start to end, both included
+def iter_days(start, end):
+    day = start
+    while day <= end:
+        yield day
+        day += timedelta(days=1)
+
+
+# Yield (day, {zone: intensities}) fetching chunk_days days of all zones concurrently at a time.
+# With a HistoryStore, stored days are read from it and complete fetched days are added to it.
+def stream_intensities(zones, days, cache=None, chunk_days=CHUNK_DAYS, store=None):
+    days = iter(days)
+    while True:
+        chunk = [day for _, day in zip(range(chunk_days), days)]
+        if len(chunk) == 0:
+            return
+        results = {}
+        if store is not None:
+            for day in chunk:
+                for zone in zones:
+                    stored = store.day(zone, day)
+                    if stored is not None:
+                        results[(zone, day)] = stored
+        fetched = fetch_many([(zone, day) for day in chunk for zone in zones if (zone, day) not in results],
+                             cache=cache)
+        if store is not None:
+            today = datetime.utcnow().date()
+            for (zone, day), values in fetched.items():
+                if len(values) == HOURS_PER_DAY and day < today:
+                    store.write(zone, day, values)
+        results.update(fetched)
+        for day in chunk:
+            yield day, {zone: results[(zone, day)] for zone in zones}
+
+
+# Stack a day's intensities into a (zones x hours) matrix, or None if any zone is incomplete
+def align_intensities(zones, day_intensities, hours=HOURS_PER_DAY):
+    rows = [day_intensities[zone] for zone in zones]
+    if any(len(row) != hours for row in rows):
+        return None
+    return np.array(rows, dtype=np.float64)
+
+
+# Yield (day, ScoreResult) for every day whose intensities are complete, and (day, None) otherwise.
+# charging is the (companies x slots) daily profile in slot_minutes slots and zone_ids maps each
+# company to a zone; the hourly intensities are resampled to the charging resolution. For multi-site
+# fleets the rows are sites and site_companies sums them into n_companies per-company results.
+def stream_scores(charging, zones, days, zone_ids=None, cache=None, hourly_capacity=HOURLY_CAPACITY,
+                  chunk_days=CHUNK_DAYS, slot_minutes=60, site_companies=None, n_companies=None, store=None):
+    for day, day_intensities in stream_intensities(zones, days, cache, chunk_days, store):
+        intensities = align_intensities(zones, day_intensities)
+        if intensities is None:
+            yield day, None
+            continue
+        intensities = resample(intensities, 60, slot_minutes)
+        results = score_companies(charging, intensities, hourly_capacity, zone_ids=zone_ids,
+                                  index=IntensityIndex(intensities), slot_hours=slot_minutes / 60)
+        if site_companies is not None:
+            results = aggregate_sites(results, site_companies, n_companies)
+        yield day, results
+
+
+# Running totals of the daily results of every company over a date range
+class RangeAggregate:
+    def __init__(self, n_companies):
+        self.days = 0
+        self.skipped_days = []
+        self.emissions = np.zeros(n_companies)
+        self.best_case = np.zeros(n_companies)
+        self.worst_case = np.zeros(n_companies)
+        self.score_sum = np.zeros(n_companies)
+        self.score_min = np.full(n_companies, np.inf)
+        self.score_max = np.full(n_companies, -np.inf)
+
+    def add(self, day, results):
+        if results is None:
+            self.skipped_days.append(day)
+            return
+        self.days += 1
+        self.emissions += results.emissions
+        self.best_case += results.best_case
+        self.worst_case += results.worst_case
+        self.score_sum += results.score
+        np.minimum(self.score_min, results.score, out=self.score_min)
+        np.maximum(self.score_max, results.score, out=self.score_max)
+
+    # Range totals, the score of the whole range and the mean/min/max of the daily scores
+    def summary(self):
+        spread = self.worst_case - self.best_case
+        with np.errstate(divide="ignore", invalid="ignore"):
+            range_score = np.where(spread == 0, 0.0, (self.emissions - self.best_case) / np.where(spread == 0, 1, spread))
+            mean_score = self.score_sum / self.days
+        return {
+            "Total Emissions (gCO2)": self.emissions,
+            "Best Case (gCO2)": self.best_case,
+            "Worst Case (gCO2)": self.worst_case,
+            "Range Score": range_score,
+            "Mean Daily Score": mean_score,
+            "Min Daily Score": self.score_min,
+            "Max Daily Score": self.score_max,
+        }
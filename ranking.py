@@ -0,0 +1,42 @@
+import numpy as np
+
+# Ranking queries over fleet scores.
+# Rank 1 is the lowest (best) score and tied companies keep their input order, exactly as in a
+# stable sort of all scores, NaN scores last. Rank ranges (pages, top-k, bottom-k, percentile bands) are answered
+# with partial selection, so only the companies in and tied with the range are ever sorted.
+
+
+# Companies holding ranks start + 1 .. stop, in rank order
+def rank_slice(scores, start, stop):
+    scores = np.asarray(scores, dtype=np.float64)
+    start, stop = max(start, 0), min(stop, len(scores))
+    if start >= stop:
+        return np.empty(0, dtype=np.intp)
+    # NaN compares false with everything, so select on it as +inf and break the tie with real +inf
+    missing = np.isnan(scores)
+    keys = np.where(missing, np.inf, scores)
+    low, high = np.partition(keys, [start, stop - 1])[[start, stop - 1]]
+    candidates = np.flatnonzero((keys >= low) & (keys <= high))
+    candidates = candidates[np.lexsort((candidates, missing[candidates], keys[candidates]))]
+    offset = start - np.count_nonzero(keys < low)
+    return candidates[offset:offset + stop - start]
+
+
+# The k best companies, best first
+def top_k(scores, k):
+    return rank_slice(scores, 0, k)
+
+
+# The k worst companies, worst first
+def bottom_k(scores, k):
+    return rank_slice(scores, len(scores) - k, len(scores))[::-1]
+
+
+# Rank range of a percentile band of the fleet, e.g. (0, 10) for the best tenth
+def percentile_ranks(n_companies, lower, upper):
+    return n_companies * lower // 100, n_companies * upper // 100
+
+
+# Companies whose rank falls in the [lower, upper) percentile band, in rank order
+def percentile_band(scores, lower, upper):
+    return rank_slice(scores, *percentile_ranks(len(scores), lower, upper))
@@ -0,0 +1,115 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+from instrumentation import metrics
+
+# Process-wide scheduling of API requests.
+# Every Streamlit session runs as a thread of one server process, so one RequestScheduler per
+# process sees the traffic of all analysts at once. A token bucket holds the request rate under
+# the API quota: requests spend a token each and wait when the bucket is empty, the most urgent
+# first (lower priority value), then in arrival order. A rate-limited response can hold the whole
+# bucket for its Retry-After. Single-flight collapses identical requests that are in flight at
+# the same time into one call whose result (or exception) every caller receives.
+
+INTERACTIVE = 0  # a page waiting on the result
+LIVE = 1  # polling for the newest hours
+BACKGROUND = 2  # batch jobs and history backfill
+
+
+class RequestScheduler:
+    # rate is the sustained requests per second and burst the bucket size; rate=None disables limiting
+    def __init__(self, rate=None, burst=1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._condition = threading.Condition()
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._resume_at = 0.0  # monotonic time before which no token is handed out
+        self._queue = []  # heap of (priority, ticket) of the waiting requests
+        self._tickets = itertools.count()
+        self._flights = {}  # key -> Future of the call in flight
+
+    def configure(self, rate=None, burst=None):
+        with self._condition:
+            self._refill(time.monotonic())
+            self.rate = rate
+            if burst is not None:
+                self.burst = max(burst, 1)
+                self._tokens = min(self._tokens, self.burst)
+            self._condition.notify_all()
+
+    def _refill(self, now):
+        if self.rate is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    # Block until this request may go out: it holds the most urgent place in the queue and the
+    # bucket has a token. Returns the seconds waited.
+    def acquire(self, priority=INTERACTIVE):
+        if self.rate is None and self._resume_at <= time.monotonic():
+            return 0.0
+        started = time.monotonic()
+        with self._condition:
+            entry = (priority, next(self._tickets))
+            heapq.heappush(self._queue, entry)
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                timeout = None  # behind another request: woken when the queue moves
+                if self._queue[0] == entry:
+                    if now < self._resume_at:
+                        timeout = self._resume_at - now
+                    elif self.rate is None or self._tokens >= 1:
+                        heapq.heappop(self._queue)
+                        if self.rate is not None:
+                            self._tokens -= 1
+                        self._condition.notify_all()
+                        break
+                    else:
+                        timeout = (1 - self._tokens) / self.rate
+                self._condition.wait(timeout)
+        waited = time.monotonic() - started
+        if waited > 0.001:
+            metrics.record_time("quota_wait", waited)
+        return waited
+
+    # Hand out no tokens for the next seconds, e.g. after a 429 response with Retry-After, and
+    # start again from an empty bucket
+    def hold(self, seconds):
+        with self._condition:
+            self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+            self._tokens = 0.0
+            self._updated = time.monotonic()
+            self._condition.notify_all()
+
+    # Call fn() unless a call for the same key is already in flight, in which case wait for that
+    # call and return its result (or raise its exception) instead
+    def single_flight(self, key, fn):
+        with self._condition:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Future()
+        metrics.record_lookup("single_flight", hit=not leader)
+        if not leader:
+            return flight.result()
+        try:
+            result = fn()
+        except BaseException as error:
+            flight.set_exception(error)
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            with self._condition:
+                del self._flights[key]
+
+    # Requests waiting for a token, e.g. to show that the quota is tight
+    @property
+    def queued(self):
+        with self._condition:
+            return len(self._queue)
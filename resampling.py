@@ -0,0 +1,46 @@
+from math import gcd
+
+import numpy as np
+
+# Resampling between time resolutions.
+# Series are (... x slots) arrays of rates (charging power in kW, carbon intensity in gCO2/kWh)
+# with a fixed slot length in minutes. A rate holds for its whole slot, so going to a finer
+# resolution repeats each value and going to a coarser one averages, which preserves the energy
+# and the emissions of every interval. Any pair of resolutions works through their common divisor.
+# Arrays are float32 to keep fine-resolution fleets compact.
+
+MINUTES_PER_DAY = 24 * 60
+HOURS_PER_DAY = MINUTES_PER_DAY // 60
+DTYPE = np.float32
+
+
+def slots_per_day(slot_minutes):
+    if MINUTES_PER_DAY % slot_minutes != 0:
+        raise ValueError(f"A day cannot be split into {slot_minutes}-minute slots.")
+    return MINUTES_PER_DAY // slot_minutes
+
+
+# Resample the last axis of values from from_minutes to to_minutes slots
+def resample(values, from_minutes, to_minutes):
+    values = np.asarray(values, dtype=DTYPE)
+    if from_minutes == to_minutes:
+        return values
+    step = gcd(from_minutes, to_minutes)
+    if from_minutes != step:
+        values = np.repeat(values, from_minutes // step, axis=-1)
+    group = to_minutes // step
+    if group > 1:
+        if values.shape[-1] % group != 0:
+            raise ValueError(f"{values.shape[-1]} slots of {step} minutes do not fill whole {to_minutes}-minute slots.")
+        values = values.reshape(values.shape[:-1] + (values.shape[-1] // group, group)).mean(axis=-1, dtype=DTYPE)
+    return values
+
+
+# Bring charging and intensities to one resolution, the finer of the two unless target_minutes is
+# given, returning (charging, intensities, slot_minutes)
+def align(charging, charging_minutes, intensities, intensity_minutes, target_minutes=None):
+    if target_minutes is None:
+        target_minutes = min(charging_minutes, intensity_minutes)
+    return (resample(charging, charging_minutes, target_minutes),
+            resample(intensities, intensity_minutes, target_minutes),
+            target_minutes)
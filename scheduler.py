@@ -0,0 +1,48 @@
+from collections import namedtuple
+
+import numpy as np
+
+from instrumentation import timed
+from scoring import HOURLY_CAPACITY, default_zone_ids
+
+# Carbon-optimal charging plans.
+# calculate_scenarios only totals the best case; this builds the plan behind it. Each company's
+# daily energy is placed in its zone's cleanest available hours, up to the hourly capacity, the
+# last hour taking only what is left. The whole fleet is planned in one vectorized pass.
+
+Schedule = namedtuple("Schedule", ["plan", "emissions", "unmet"])
+
+
+# Plan the daily energy (kWh per company) over the slots of each company's zone.
+# intensities holds one row per zone and zone_ids picks each company's row (row i for company i
+# by default). hourly_capacity (kW) is a scalar or broadcasts against the (companies x slots) plan,
+# and availability is an optional boolean (companies x slots) mask of when a company can charge.
+# Slots are hours unless slot_hours says otherwise; the plan is in kW per slot and unmet is the
+# energy that did not fit in the available capacity.
+@timed("schedule")
+def optimal_schedule(daily_energy, intensities, hourly_capacity=HOURLY_CAPACITY, availability=None,
+                     zone_ids=None, slot_hours=1.0):
+    daily_energy = np.atleast_1d(np.asarray(daily_energy, dtype=np.float64))
+    intensities = np.atleast_2d(np.asarray(intensities, dtype=np.float64))
+    n_companies, hours = len(daily_energy), intensities.shape[-1]
+    if zone_ids is None:
+        zone_ids = default_zone_ids(intensities.shape[0], n_companies)
+    company_intensities = intensities[zone_ids]
+    capacity = np.broadcast_to(np.asarray(hourly_capacity, dtype=np.float64) * slot_hours, (n_companies, hours))
+
+    if availability is None:
+        # Companies sharing a zone share its ordering, so sort each zone once
+        order = np.argsort(intensities, axis=-1, kind="stable")[zone_ids]
+    else:
+        availability = np.broadcast_to(np.asarray(availability, dtype=bool), (n_companies, hours))
+        capacity = np.where(availability, capacity, 0.0)
+        order = np.argsort(np.where(availability, company_intensities, np.inf), axis=-1, kind="stable")
+
+    sorted_capacity = np.take_along_axis(capacity, order, axis=-1)
+    filled_before = np.cumsum(sorted_capacity, axis=-1) - sorted_capacity
+    sorted_plan = np.clip(daily_energy[:, None] - filled_before, 0.0, sorted_capacity)
+
+    plan = np.empty_like(sorted_plan)
+    np.put_along_axis(plan, order, sorted_plan, axis=-1)
+    emissions = np.sum(plan * company_intensities, axis=-1)
+    return Schedule(plan / slot_hours, emissions, daily_energy - plan.sum(axis=-1))
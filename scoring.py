@@ -0,0 +1,212 @@
+from collections import namedtuple
+
+import numpy as np
+
+from instrumentation import timed
+
+# Emission scoring for any number of companies.
+# The per-company functions below score a single charging profile; score_companies scores a whole
+# fleet at once from a companies x hours charging matrix and the intensities of their zones,
+# score_sites does the same for companies charging at sites in several zones and capacity_sweep
+# scores a fleet over a whole grid of hourly capacities.
+
+HOURLY_CAPACITY = 10  # kW that can be charged in one hour
+
+ScoreResult = namedtuple("ScoreResult", [
+    "emissions", "hourly_emissions", "best_case", "worst_case",
+    "score", "percent_away_best", "percent_away_worst",
+])
+
+CapacitySweep = namedtuple("CapacitySweep", ["capacities", "emissions", "best_case", "worst_case", "score"])
+
+
+# Function to calculate total daily emissions
+def calculate_daily_emissions(charging, emissions):
+    hourly_emissions = charging * emissions
+    daily_emissions = np.sum(hourly_emissions)
+    return daily_emissions, hourly_emissions
+
+
+# Function to calculate emission scenarios
+def calculate_scenarios(total_charging, emissions, hourly_capacity=HOURLY_CAPACITY):
+    emissions_sorted_asc = np.sort(emissions)
+    emissions_sorted_desc = emissions_sorted_asc[::-1]
+
+    hours_needed = int(np.ceil(total_charging / hourly_capacity))
+
+    best_case_total = np.sum(hourly_capacity * emissions_sorted_asc[:hours_needed])
+    worst_case_total = np.sum(hourly_capacity * emissions_sorted_desc[:hours_needed])
+
+    return best_case_total, worst_case_total
+
+
+# Calculate the score using the new approach
+def calculate_score(actual_emissions, best_case, worst_case):
+    if worst_case == best_case:
+        return 0  # or any other value that makes sense for your application
+    return (actual_emissions - best_case) / (worst_case - best_case)
+
+
+# Calculate detailed percentages
+def calculate_percentages(actual_emissions, best_case, worst_case):
+    away_best = ((actual_emissions - best_case) / best_case) * 100
+    away_worst = ((worst_case - actual_emissions) / worst_case) * 100
+    return away_best, away_worst
+
+
+# Zone row of each of n_rows charging rows when none are given: the only zone, or row i for row i
+def default_zone_ids(n_zones, n_rows):
+    if n_zones == 1:
+        return np.zeros(n_rows, dtype=np.intp)
+    return np.arange(n_rows)
+
+
+# Sum the last axis of values, one entry per site, into one entry per company, e.g. (days x sites)
+# totals into (days x companies), in a single bincount over all leading rows
+def sum_sites(values, site_companies, n_companies):
+    values = np.asarray(values, dtype=np.float64)
+    leading = values.shape[:-1]
+    rows = int(np.prod(leading))
+    flat = (np.arange(rows)[:, None] * n_companies + np.asarray(site_companies, dtype=np.intp)).ravel()
+    totals = np.bincount(flat, weights=values.reshape(rows, -1).ravel(), minlength=rows * n_companies)
+    return totals.reshape(leading + (n_companies,))
+
+
+# Sorted intensities and their prefix sums for one or more zones on one day.
+# Built once per zone and day, it answers best and worst case for any total charging and
+# hourly capacity with a constant-time lookup, vectorized over all companies sharing the zone.
+class IntensityIndex:
+    def __init__(self, intensities):
+        intensities = np.atleast_2d(np.asarray(intensities, dtype=np.float64))
+        self.intensities = intensities
+        self.hours = intensities.shape[-1]
+        self.sorted_asc = np.sort(intensities, axis=-1)
+        zeros = np.zeros((intensities.shape[0], 1))
+        self.prefix_asc = np.concatenate([zeros, np.cumsum(self.sorted_asc, axis=-1)], axis=-1)
+        self.prefix_desc = np.concatenate([zeros, np.cumsum(self.sorted_asc[:, ::-1], axis=-1)], axis=-1)
+
+    # Row of the index each company is scored against when no zone ids are given
+    def default_zone_ids(self, n_companies):
+        return default_zone_ids(self.intensities.shape[0], n_companies)
+
+    def hours_needed(self, total_charging, hourly_capacity=HOURLY_CAPACITY):
+        hours_needed = np.ceil(np.asarray(total_charging, dtype=np.float64) / hourly_capacity)
+        return np.clip(hours_needed, 0, self.hours).astype(np.intp)
+
+    # Best and worst case for each company, filling the cleanest (or dirtiest) slots of its zone
+    # at hourly_capacity (the energy one slot can take) until its total charging is covered
+    def scenarios(self, total_charging, zone_ids=None, hourly_capacity=HOURLY_CAPACITY):
+        total_charging = np.atleast_1d(total_charging)
+        if zone_ids is None:
+            zone_ids = self.default_zone_ids(len(total_charging))
+        hours_needed = self.hours_needed(total_charging, hourly_capacity)
+        best_case = hourly_capacity * self.prefix_asc[zone_ids, hours_needed]
+        worst_case = hourly_capacity * self.prefix_desc[zone_ids, hours_needed]
+        return best_case, worst_case
+
+
+# Score a fleet in one pass: charging is a (companies x slots) matrix of kW and intensities holds one
+# row per zone, zone_ids giving the row each company charges from (row i for company i by default).
+# Slots are hours unless slot_hours says otherwise (e.g. 0.25 for 15-minute data).
+# A prebuilt IntensityIndex for the same intensities can be passed to skip sorting them again.
+@timed("score")
+def score_companies(charging, intensities, hourly_capacity=HOURLY_CAPACITY, zone_ids=None, index=None,
+                    slot_hours=1.0):
+    charging = np.atleast_2d(np.asarray(charging, dtype=np.float64))
+    if index is None:
+        index = IntensityIndex(intensities)
+    if zone_ids is None:
+        zone_ids = index.default_zone_ids(charging.shape[0])
+    zone_ids = np.asarray(zone_ids, dtype=np.intp)
+
+    energy = charging * slot_hours if slot_hours != 1.0 else charging
+    hourly_emissions = energy * index.intensities[zone_ids]
+    emissions = hourly_emissions.sum(axis=-1)
+    best_case, worst_case = index.scenarios(energy.sum(axis=-1), zone_ids, hourly_capacity * slot_hours)
+
+    return score_from_totals(emissions, hourly_emissions, best_case, worst_case)
+
+
+# Score, and percentages away from the best and worst case, from emission totals and scenarios
+def score_from_totals(emissions, hourly_emissions, best_case, worst_case):
+    spread = worst_case - best_case
+    with np.errstate(divide="ignore", invalid="ignore"):
+        score = np.where(spread == 0, 0.0, (emissions - best_case) / np.where(spread == 0, 1, spread))
+        percent_away_best = (emissions - best_case) / best_case * 100
+        percent_away_worst = (worst_case - emissions) / worst_case * 100
+
+    return ScoreResult(emissions, hourly_emissions, best_case, worst_case,
+                       score, percent_away_best, percent_away_worst)
+
+
+# Multi-site companies are scored as sites: one charging profile per (company, zone) pair, given
+# by the parallel site_companies and site_zones codes (a sparse company x zone assignment).
+# Sum the results of each company's sites into the results of the company; its best and worst
+# case are those of its sites together, each site filling its own zone's slots.
+def aggregate_sites(sites, site_companies, n_companies=None):
+    site_companies = np.asarray(site_companies, dtype=np.intp)
+    if n_companies is None:
+        n_companies = int(site_companies.max()) + 1 if len(site_companies) else 0
+
+    def total(values):
+        return sum_sites(values, site_companies, n_companies)
+
+    return score_from_totals(total(sites.emissions), total(sites.hourly_emissions.T).T,
+                             total(sites.best_case), total(sites.worst_case))
+
+
+# Score every site of a fleet in one batched pass and aggregate the sites per company
+def score_sites(site_charging, intensities, site_companies, site_zones, hourly_capacity=HOURLY_CAPACITY,
+                n_companies=None, index=None, slot_hours=1.0):
+    sites = score_companies(site_charging, intensities, hourly_capacity, zone_ids=site_zones, index=index,
+                            slot_hours=slot_hours)
+    return aggregate_sites(sites, site_companies, n_companies)
+
+
+# Best case, worst case and score of every company at every hourly capacity of a grid, as
+# (capacities x companies) arrays. Actual emissions do not depend on the capacity, and one
+# IntensityIndex (a single sort per zone) answers the scenarios of the whole grid in one lookup.
+# For multi-site fleets the charging rows are sites and site_companies sums them per company.
+@timed("capacity_sweep")
+def capacity_sweep(charging, intensities, capacities, zone_ids=None, index=None, slot_hours=1.0,
+                   site_companies=None, n_companies=None):
+    charging = np.atleast_2d(np.asarray(charging, dtype=np.float64))
+    capacities = np.asarray(capacities, dtype=np.float64)
+    if index is None:
+        index = IntensityIndex(intensities)
+    if zone_ids is None:
+        zone_ids = index.default_zone_ids(charging.shape[0])
+    zone_ids = np.asarray(zone_ids, dtype=np.intp)
+
+    energy = charging * slot_hours if slot_hours != 1.0 else charging
+    emissions = (energy * index.intensities[zone_ids]).sum(axis=-1)
+    best_case, worst_case = index.scenarios(energy.sum(axis=-1), zone_ids, capacities[:, None] * slot_hours)
+    if site_companies is not None:
+        n_companies = n_companies or int(np.max(site_companies)) + 1
+        emissions, best_case, worst_case = (sum_sites(values, site_companies, n_companies)
+                                            for values in (emissions, best_case, worst_case))
+    results = score_from_totals(np.broadcast_to(emissions, best_case.shape), None, best_case, worst_case)
+    return CapacitySweep(capacities, emissions, best_case, worst_case, results.score)
+
+
+# Codes of labelled sites: unique companies and zones in order of first appearance, and each
+# site's index into them. zones fixes the zone order (e.g. the rows of an intensity matrix).
+def encode_sites(site_company_names, site_zone_names, zones=None):
+    def encode(names, labels=None):
+        unique, first, inverse = np.unique(np.asarray(names, dtype=str), return_index=True,
+                                           return_inverse=True)
+        if labels is None:
+            order = np.argsort(first)
+            labels = [str(label) for label in unique[order]]
+            codes = np.argsort(order)[inverse]
+        else:
+            lookup = {label: code for code, label in enumerate(labels)}
+            missing = [name for name in unique if name not in lookup]
+            if missing:
+                raise ValueError(f"No carbon intensities for zone(s) {', '.join(missing)}.")
+            codes = np.array([lookup[name] for name in unique], dtype=np.intp)[inverse]
+        return list(labels), codes.astype(np.intp)
+
+    companies, site_companies = encode(site_company_names)
+    zones, site_zones = encode(site_zone_names, zones)
+    return companies, zones, site_companies, site_zones
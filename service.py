@@ -0,0 +1,347 @@
+import argparse
+import json
+import math
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from carbon_api import fetch_many
+from history_store import HistoryStore
+from instrumentation import metrics
+from intensity_cache import CACHE_PATH, TODAY_TTL_SECONDS, IntensityCache
+from pipeline import parse_date
+from resampling import resample, slots_per_day
+from scoring import HOURLY_CAPACITY, IntensityIndex, default_zone_ids, score_companies
+
+# HTTP scoring service exposing the emissions engine to other systems (e.g. dispatch).
+# POST /score with {"date": "2024-07-01", "zones": ["DE", "FR"], "charging": [[kW per slot], ...]}
+# and optionally "zone_ids" (each profile's index into zones, by default the single zone or one
+# zone per profile), "companies", "capacity" (kW) and "resolution" (minutes per slot) answers
+# {"companies", "emissions", "best_case", "worst_case", "score", "percent_away_best",
+# "percent_away_worst"} as one list per field. Handler threads parse and validate requests and
+# look up their intensities, fetching days not seen yet, so a slow fetch only holds its own
+# request: a single batcher thread takes every ready request queued within max_wait and scores all
+# those sharing a day, capacity and resolution in one score_companies call over the union of
+# their zones. Intensities are held in memory in front of the on-disk IntensityCache (and the
+# HistoryStore), so the API is only called for days no earlier request needed. GET /metrics serves
+# Prometheus text.
+#
+#   python service.py --port 8502 --store .intensity_history
+#   curl -d '{"date": "2024-07-01", "zones": ["DE"], "charging": [[0, 0, 11, ...]]}' localhost:8502/score
+
+PORT = 8502
+MAX_WAIT_SECONDS = 0.002  # how long the batcher lingers for more requests after the first
+MAX_BATCH_ROWS = 1 << 16  # charging profiles per scoring call
+MAX_BODY_BYTES = 16 << 20
+REQUEST_TIMEOUT = 60  # seconds to wait for a request's batch to be scored
+MAX_CACHED_ZONE_DAYS = 4096
+RESULT_FIELDS = ["emissions", "best_case", "worst_case", "score", "percent_away_best", "percent_away_worst"]
+
+ScoreRequest = namedtuple("ScoreRequest", [
+    "day", "zones", "charging", "zone_ids", "companies", "capacity", "slot_minutes",
+])
+
+
+class RequestError(ValueError):
+    pass
+
+
+class MissingIntensities(Exception):
+    pass
+
+
+# Validate a decoded /score body into a ScoreRequest, raising RequestError with the reason
+def parse_request(body):
+    if not isinstance(body, dict):
+        raise RequestError("The body must be a JSON object.")
+    try:
+        day = parse_date(str(body["date"]))
+        zones = body["zones"]
+        charging = np.array(body["charging"], dtype=np.float64, ndmin=2)
+    except KeyError as error:
+        raise RequestError(f"Missing field {error}.") from None
+    except (TypeError, ValueError):
+        raise RequestError("'date' must be YYYY-MM-DD, 'zones' a list and 'charging' a list of "
+                           "equally long lists of numbers.") from None
+    if not isinstance(zones, list) or not all(isinstance(zone, str) for zone in zones):
+        raise RequestError("'zones' must be a list of zone names.")
+    slot_minutes = body.get("resolution", 60)
+    if isinstance(slot_minutes, bool) or not isinstance(slot_minutes, int) or slot_minutes <= 0:
+        raise RequestError("'resolution' must be a positive whole number of minutes.")
+    try:
+        slots = slots_per_day(slot_minutes)
+    except ValueError as error:
+        raise RequestError(str(error)) from None
+    capacity = body.get("capacity", HOURLY_CAPACITY)
+    if isinstance(capacity, bool) or not isinstance(capacity, (int, float)) or not math.isfinite(capacity) \
+            or capacity <= 0:
+        raise RequestError("'capacity' must be a positive number of kW.")
+    if len(zones) == 0 or charging.ndim != 2 or charging.shape[1] != slots:
+        raise RequestError(f"Expected at least one zone and profiles of {slots} {slot_minutes}-minute slots.")
+    if not np.isfinite(charging).all():
+        raise RequestError("Charging values must be finite numbers.")
+    if "zone_ids" in body:
+        zone_ids = body["zone_ids"]
+        if (not isinstance(zone_ids, list) or len(zone_ids) != len(charging)
+                or not all(isinstance(zone, int) and not isinstance(zone, bool) and 0 <= zone < len(zones)
+                            for zone in zone_ids)):
+            raise RequestError("'zone_ids' must give one index into 'zones' per charging profile.")
+        zone_ids = np.array(zone_ids, dtype=np.intp)
+    elif len(zones) in (1, len(charging)):
+        zone_ids = default_zone_ids(len(zones), len(charging))
+    else:
+        raise RequestError("Give one zone for all profiles, one zone per profile, or 'zone_ids'.")
+    companies = body.get("companies")
+    if companies is not None and (not isinstance(companies, list) or len(companies) != len(charging)):
+        raise RequestError("'companies' must name every charging profile.")
+    return ScoreRequest(day, zones, charging, zone_ids, companies, capacity, slot_minutes)
+
+
+# Hourly intensities of (zone, day) pairs: complete past days are kept in memory for good (least
+# recently used first out), other days for the cache's TTL of the current day. Used from every
+# handler thread; concurrent fetches of one zone and day share a request through the scheduler.
+class DayIntensities:
+    def __init__(self, cache=None, store=None, max_entries=MAX_CACHED_ZONE_DAYS):
+        self.cache = cache
+        self.store = store
+        self.max_entries = max_entries
+        self._rows = OrderedDict()  # (zone, day) -> (hourly float64 values, expiry monotonic time)
+        self._lock = threading.Lock()
+
+    # {zone: hourly values} of the zones whose 24 hours of day are available
+    def get(self, zones, day):
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for zone in zones:
+                entry = self._rows.get((zone, day))
+                hit = entry is not None and entry[1] > now
+                metrics.record_lookup("service_intensities", hit)
+                if hit:
+                    self._rows.move_to_end((zone, day))
+                    found[zone] = entry[0]
+                else:
+                    missing.append(zone)
+        if self.store is not None:
+            for zone in list(missing):
+                stored = self.store.day(zone, day)
+                if stored is not None:
+                    found[zone] = self._put(zone, day, stored, math.inf)
+                    missing.remove(zone)
+        if missing:
+            complete_day = day < datetime.utcnow().date()
+            for (zone, _), values in fetch_many([(zone, day) for zone in missing], cache=self.cache).items():
+                if len(values) == 24:
+                    found[zone] = self._put(zone, day, values, math.inf if complete_day else now + TODAY_TTL_SECONDS)
+        return found
+
+    # {zone: hourly values} for every zone, raising MissingIntensities naming the zones without data
+    def require(self, zones, day):
+        found = self.get(zones, day)
+        missing = [zone for zone in zones if zone not in found]
+        if missing:
+            raise MissingIntensities(f"No complete carbon intensity data for {', '.join(missing)} on {day}.")
+        return found
+
+    def _put(self, zone, day, values, expires):
+        values = np.asarray(values, dtype=np.float64)
+        with self._lock:
+            self._rows[(zone, day)] = (values, expires)
+            while len(self._rows) > self.max_entries:
+                self._rows.popitem(last=False)
+        return values
+
+
+# Collects concurrently submitted ScoreRequests, whose intensities are already looked up, and
+# scores them in vectorized batches on one thread
+class MicroBatcher:
+    def __init__(self, max_wait=MAX_WAIT_SECONDS, max_rows=MAX_BATCH_ROWS):
+        self.max_wait = max_wait
+        self.max_rows = max_rows
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="score-batcher", daemon=True)
+        self._thread.start()
+
+    # Future of the request's results, a dict of one array per RESULT_FIELDS entry; intensities
+    # holds the hourly values of every zone of the request
+    def submit(self, request, intensities):
+        future = Future()
+        self._queue.put((request, intensities, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            rows = len(batch[0][0].charging)
+            deadline = time.monotonic() + self.max_wait
+            while rows < self.max_rows:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                batch.append(item)
+                rows += len(item[0].charging)
+            groups = {}
+            for item in batch:
+                request = item[0]
+                groups.setdefault((request.day, request.capacity, request.slot_minutes), []).append(item)
+            for group in groups.values():
+                try:
+                    self._score(group)
+                except Exception:
+                    # never let one bad request fail the others: score them one at a time instead
+                    for item in group:
+                        try:
+                            self._score([item])
+                        except Exception as error:
+                            item[2].set_exception(error)
+
+    # Score requests of one day, capacity and resolution in a single pass
+    def _score(self, group):
+        capacity, slot_minutes = group[0][0].capacity, group[0][0].slot_minutes
+        available = {}
+        for _, intensities, _ in group:
+            available.update(intensities)
+        zones = list(available)
+        position = {zone: i for i, zone in enumerate(zones)}
+        intensities = resample(np.stack([available[zone] for zone in zones]), 60, slot_minutes).astype(np.float64)
+        charging = np.concatenate([request.charging for request, _, _ in group])
+        zone_ids = np.concatenate([np.array([position[zone] for zone in request.zones])[request.zone_ids]
+                                   for request, _, _ in group])
+        with metrics.stage("service_batch"):
+            results = score_companies(charging, intensities, capacity, zone_ids=zone_ids,
+                                      index=IntensityIndex(intensities), slot_hours=slot_minutes / 60)
+        start = 0
+        for request, _, future in group:
+            stop = start + len(request.charging)
+            future.set_result({field: getattr(results, field)[start:stop] for field in RESULT_FIELDS})
+            start = stop
+
+
+def _json_column(values):
+    values = values.tolist()
+    if all(map(math.isfinite, values)):
+        return values
+    return [value if math.isfinite(value) else None for value in values]
+
+
+def make_handler(batcher, intensities):
+    class ScoreHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive for clients sending many requests
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body, content_type="application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _error(self, status, message):
+            self._send(status, json.dumps({"error": message}).encode())
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send(200, b'{"status": "ok"}')
+            elif self.path == "/metrics":
+                self._send(200, metrics.to_prometheus().encode(), "text/plain; version=0.0.4")
+            else:
+                self._error(404, "not found")
+
+        def do_POST(self):
+            # the body cannot be skipped without a valid length, so the connection is closed instead
+            length = self.headers.get("Content-Length")
+            if length is None:
+                self.close_connection = True
+                self._error(411, "A Content-Length header is required.")
+                return
+            try:
+                length = int(length)
+            except ValueError:
+                length = -1
+            if length < 0:
+                self.close_connection = True
+                self._error(400, "The Content-Length header must be a non-negative whole number.")
+                return
+            if self.path != "/score":
+                self.rfile.read(length)
+                self._error(404, "not found")
+                return
+            if length > MAX_BODY_BYTES:
+                self.close_connection = True
+                self._error(413, f"Bodies are limited to {MAX_BODY_BYTES} bytes.")
+                return
+            try:
+                request = parse_request(json.loads(self.rfile.read(length)))
+            except json.JSONDecodeError:
+                self._error(400, "The body is not valid JSON.")
+                return
+            except RequestError as error:
+                self._error(400, str(error))
+                return
+            try:
+                # looked up on this thread, so a day still being fetched holds this request only
+                available = intensities.require(request.zones, request.day)
+                results = batcher.submit(request, available).result(timeout=REQUEST_TIMEOUT)
+            except MissingIntensities as error:
+                self._error(503, str(error))
+                return
+            except Exception as error:
+                self._error(500, str(error))
+                return
+            companies = request.companies if request.companies is not None else list(range(len(request.charging)))
+            body = {"companies": companies}
+            body.update((field, _json_column(values)) for field, values in results.items())
+            self._send(200, json.dumps(body).encode())
+
+    return ScoreHandler
+
+
+def make_server(host="127.0.0.1", port=PORT, cache=None, store=None, max_wait=MAX_WAIT_SECONDS,
+                max_rows=MAX_BATCH_ROWS):
+    server = ThreadingHTTPServer((host, port), make_handler(MicroBatcher(max_wait, max_rows),
+                                                            DayIntensities(cache, store)))
+    server.daemon_threads = True
+    return server
+
+
+# Serve in a background thread, returning (server, base_url); call server.shutdown() to stop
+def start_in_thread(host="127.0.0.1", port=0, **options):
+    server = make_server(host, port, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve fleet scoring over HTTP with micro-batching.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--cache", default=CACHE_PATH, help="intensity cache file")
+    parser.add_argument("--store", help="memory-mapped history store directory to read")
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_SECONDS * 1000,
+                        help="how long a batch waits for more requests")
+    parser.add_argument("--max-rows", type=int, default=MAX_BATCH_ROWS, help="charging profiles per batch")
+    args = parser.parse_args(argv)
+
+    server = make_server(args.host, args.port, IntensityCache(args.cache),
+                         HistoryStore(args.store) if args.store else None, args.max_wait_ms / 1000, args.max_rows)
+    print(f"Scoring service on http://{args.host}:{server.server_address[1]}/score", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+import numpy as np
+
+from incremental import FleetGraph
+from ranking import bottom_k, percentile_band, rank_slice, top_k
+from scoring import score_companies
+
+# Ranking queries must agree with a stable sort of all scores, NaN and infinite scores included, and
+# incrementally maintained results with scoring the whole fleet from scratch.
+
+
+def _scores(rng, n):
+    scores = rng.integers(0, 6, n).astype(np.float64)  # few distinct values, so plenty of ties
+    scores[rng.random(n) < 0.2] = np.nan
+    scores[rng.random(n) < 0.1] = np.inf
+    scores[rng.random(n) < 0.1] = -np.inf
+    return scores
+
+
+def test_rank_slice_matches_stable_argsort():
+    rng = np.random.default_rng(0)
+    for _ in range(500):
+        n = int(rng.integers(1, 40))
+        scores = _scores(rng, n)
+        order = np.argsort(scores, kind="stable")
+        start, stop = sorted(rng.integers(-2, n + 3, 2))
+        np.testing.assert_array_equal(rank_slice(scores, start, stop), order[max(start, 0):max(stop, 0)])
+        k = int(rng.integers(0, n + 1))
+        np.testing.assert_array_equal(top_k(scores, k), order[:k])
+        np.testing.assert_array_equal(bottom_k(scores, k), order[n - k:][::-1])
+        np.testing.assert_array_equal(percentile_band(scores, 10, 60), order[n * 10 // 100:n * 60 // 100])
+
+
+def test_rank_slice_puts_nan_last():
+    scores = np.array([np.nan, 2.0, np.inf, np.nan, 1.0])
+    np.testing.assert_array_equal(rank_slice(scores, 0, 5), [4, 1, 2, 0, 3])
+    np.testing.assert_array_equal(rank_slice(scores, 3, 5), [0, 3])
+
+
+def _assert_same_results(actual, expected):
+    for field, a, b in zip(expected._fields, actual, expected):
+        np.testing.assert_allclose(a, b, rtol=1e-12, equal_nan=True, err_msg=field)
+
+
+def test_fleet_graph_matches_score_companies():
+    rng = np.random.default_rng(1)
+    charging = rng.random((50, 24)) * 20
+    intensities = rng.random((3, 24)) * 400 + 50
+    zone_ids = rng.integers(0, 3, 50)
+    graph = FleetGraph(charging, intensities, zone_ids)
+    _assert_same_results(graph.results(), score_companies(charging, intensities, zone_ids=zone_ids))
+
+    charging[[3, 17]] = rng.random((2, 24)) * 20
+    assert graph.update(charging) == 2
+    _assert_same_results(graph.results(), score_companies(charging, intensities, zone_ids=zone_ids))
+
+    intensities[1] = rng.random(24) * 400 + 50
+    assert graph.update(charging, intensities) == np.count_nonzero(zone_ids == 1)
+    _assert_same_results(graph.results(), score_companies(charging, intensities, zone_ids=zone_ids))
+    assert graph.update(charging, intensities) == 0
@@ -0,0 +1,97 @@
+import multiprocessing
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from instrumentation import timed
+from scoring import HOURLY_CAPACITY, aggregate_sites, default_zone_ids, score_companies
+
+# Monte Carlo uncertainty of company scores and ranks.
+# Each draw perturbs every charging value and every zone intensity with independent multiplicative
+# Gaussian noise. A batch of draws is held as 3-D (draws x rows x slots) arrays and scored in one
+# pass by flattening the draws into rows, each draw's zones getting their own intensity rows.
+# Batches have their own child seed of one SeedSequence, so a seed gives the same result with or
+# without the process pool, which is used for large runs.
+
+DRAWS = 1000
+CONFIDENCE = 0.95
+BATCH_ELEMENTS = 1 << 22  # charging values per batch of draws
+POOL_MIN_ELEMENTS = 1 << 25  # total charging values above which batches go to a process pool
+
+Uncertainty = namedtuple("Uncertainty", [
+    "score_mean", "score_low", "score_high", "rank_median", "rank_low", "rank_high", "draws",
+])
+
+
+# draws copies of values, each scaled by factors drawn from N(1, noise) and clipped at zero
+def _perturb(rng, values, noise, draws):
+    if noise == 0:
+        return np.broadcast_to(values, (draws,) + values.shape)
+    perturbed = rng.standard_normal((draws,) + values.shape, dtype=np.float32)
+    perturbed *= noise
+    perturbed += 1
+    perturbed *= values
+    return np.maximum(perturbed, 0, out=perturbed)
+
+
+# Scores and ranks of one batch of draws as (draws x companies) float32 and int32 arrays
+def _score_batch(seed, draws, charging, intensities, zone_ids, charging_noise, intensity_noise,
+                 hourly_capacity, slot_hours, site_companies, n_companies):
+    rng = np.random.default_rng(seed)
+    n_rows, n_zones = charging.shape[0], intensities.shape[0]
+    draw_charging = _perturb(rng, charging, charging_noise, draws)
+    draw_intensities = _perturb(rng, intensities, intensity_noise, draws)
+    draw_zone_ids = (np.arange(draws)[:, None] * n_zones + zone_ids).ravel()
+    results = score_companies(draw_charging.reshape(draws * n_rows, -1), draw_intensities.reshape(draws * n_zones, -1),
+                              hourly_capacity, zone_ids=draw_zone_ids, slot_hours=slot_hours)
+    if site_companies is not None:
+        draw_companies = (np.arange(draws)[:, None] * n_companies + site_companies).ravel()
+        results = aggregate_sites(results, draw_companies, draws * n_companies)
+    scores = results.score.reshape(draws, -1)
+    ranks = np.empty(scores.shape, dtype=np.int32)
+    np.put_along_axis(ranks, np.argsort(scores, axis=-1, kind="stable"),
+                      np.arange(1, scores.shape[1] + 1, dtype=np.int32)[None, :], axis=-1)
+    return scores.astype(np.float32), ranks
+
+
+# Score and rank confidence intervals of every company over draws perturbed fleets.
+# charging_noise and intensity_noise are the relative standard deviations of the perturbations and
+# confidence the central share of draws the intervals cover. For multi-site fleets the charging
+# rows are sites and site_companies sums them into n_companies companies. processes=None uses a
+# process pool of every CPU for large runs only, processes=1 never does.
+@timed("monte_carlo")
+def monte_carlo(charging, intensities, zone_ids=None, draws=DRAWS, charging_noise=0.1, intensity_noise=0.1,
+                hourly_capacity=HOURLY_CAPACITY, slot_hours=1.0, seed=None, confidence=CONFIDENCE,
+                processes=None, site_companies=None, n_companies=None):
+    charging = np.atleast_2d(np.asarray(charging, dtype=np.float64))
+    intensities = np.atleast_2d(np.asarray(intensities, dtype=np.float64))
+    if zone_ids is None:
+        zone_ids = default_zone_ids(len(intensities), len(charging))
+    zone_ids = np.asarray(zone_ids, dtype=np.intp)
+    if site_companies is not None:
+        site_companies = np.asarray(site_companies, dtype=np.intp)
+        n_companies = n_companies or int(site_companies.max()) + 1
+
+    batch_draws = max(1, min(draws, BATCH_ELEMENTS // charging.size))
+    sizes = [min(batch_draws, draws - start) for start in range(0, draws, batch_draws)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    shared = (charging, intensities, zone_ids, charging_noise, intensity_noise, hourly_capacity, slot_hours,
+              site_companies, n_companies)
+    if processes is None:
+        processes = os.cpu_count() if draws * charging.size >= POOL_MIN_ELEMENTS else 1
+    if processes > 1 and len(sizes) > 1:
+        # spawn rather than fork, as the caller (e.g. the Streamlit server) may be running threads
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+            batches = list(pool.map(_score_batch, seeds, sizes, *([value] * len(sizes) for value in shared)))
+    else:
+        batches = [_score_batch(child, size, *shared) for child, size in zip(seeds, sizes)]
+
+    scores = np.concatenate([batch[0] for batch in batches])
+    ranks = np.concatenate([batch[1] for batch in batches])
+    tails = [(1 - confidence) / 2, (1 + confidence) / 2]
+    score_low, score_high = np.quantile(scores, tails, axis=0)
+    rank_low, rank_high = np.quantile(ranks, tails, axis=0, method="nearest")
+    return Uncertainty(scores.mean(axis=0, dtype=np.float64), score_low, score_high,
+                       np.quantile(ranks, 0.5, axis=0, method="nearest"), rank_low, rank_high, draws)